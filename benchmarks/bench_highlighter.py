@@ -0,0 +1,261 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/10 10:15
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: bench_highlighter.py
+"""
+PythonHighlighter的无界面性能测试。在仓库根目录下运行：
+
+    python benchmarks/bench_highlighter.py --sizes 1000,10000 --output result.json
+
+对每种合成代码（见corpus.py）和每个行数，测量：
+- rehighlight: 整篇文档重新着色的耗时和吞吐量，分别在词法缓存为空（cold）和已填满（warm）时测量；
+- keystroke: 普通模式和懒惰模式下，单次按键（插入一个字符）后重新着色的耗时，
+  插入三引号、使之后所有块的状态改变的最坏情况（cascade），以及在代码行末插入一个未闭合的括号（bracket）；
+- memory: 整篇着色过程中Python分配内存的峰值（tracemalloc），以及到目前为止进程的最大常驻内存。
+结果写入JSON文件，与之前的结果比较即可发现热点路径上的性能退化。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qtpy import API_NAME, QT_VERSION
+from qtpy.QtGui import QTextDocument, QTextCursor
+from qtpy.QtWidgets import QApplication, QPlainTextDocumentLayout
+
+from qtpyeditor.highlighters import PythonHighlighter
+from qtpyeditor.highlighters.tokenizer import STATE_NORMAL, STATE_TRIPLEDOUBLE
+
+import corpus
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+VISIBLE_MARGIN = 50  # 懒惰模式下，按键所在行上下视为可见的块数
+
+
+def _new_document(text: str) -> QTextDocument:
+    document = QTextDocument()
+    # 没有layout的QTextDocument在编辑时不会通知高亮器。
+    document.setDocumentLayout(QPlainTextDocumentLayout(document))
+    document.setPlainText(text)
+    return document
+
+
+def _new_highlighter(document: QTextDocument, marks: Optional[tuple], lazy: bool = False) -> PythonHighlighter:
+    highlighter = PythonHighlighter()
+    if marks is not None:
+        # 在关联文档之前注册，不触发逐行重新着色。
+        highlighter.register_highlights(*marks)
+    highlighter.set_lazy(lazy)
+    # 与编辑器中一样作为文档的子对象，随文档一起销毁。
+    highlighter.setParent(document)
+    highlighter.setDocument(document)
+    return highlighter
+
+
+def _max_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage  # macOS的单位是字节
+
+
+def _latency_stats(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {'samples': len(samples),
+            'p50_ms': statistics.median(samples) * 1e3,
+            'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e3,
+            'max_ms': samples[-1] * 1e3}
+
+
+def _cascade_line(document: QTextDocument, highlighter: PythonHighlighter, start: int) -> int:
+    """
+    从start开始找一行，使行首插入三引号后开始一个新的三引号字符串，之后所有块的状态都随之改变：
+    上一行结束时处于普通状态且没有续行，本行中没有引号（不会在本行内闭合）
+    :param document:
+    :param highlighter:
+    :param start:
+    :return:
+    """
+    for line in range(max(start, 1), document.blockCount() - 1):
+        state = highlighter.block_state(line - 1)
+        text = document.findBlockByNumber(line).text()
+        if state is not None and state.mode == STATE_NORMAL and not state.continued and \
+                '"' not in text and "'" not in text:
+            return line
+    raise ValueError('no line after %d where inserting \'"""\' changes the following block states' % start)
+
+
+def _code_line(document: QTextDocument, highlighter: PythonHighlighter, start: int) -> int:
+    """
+    从start开始找一行，行末属于代码（不在字符串、注释或续行中），在行末插入的括号是一个未闭合的括号
+    :param document:
+    :param highlighter:
+    :param start:
+    :return:
+    """
+    for line in range(max(start, 1), document.blockCount() - 1):
+        state = highlighter.block_state(line)
+        text = document.findBlockByNumber(line).text()
+        if state is not None and state.mode == STATE_NORMAL and not state.continued and text.strip() and \
+                not any(c in text for c in '#\'"\\'):
+            return line
+    raise ValueError('no code line after %d' % start)
+
+
+def bench_rehighlight(text: str, lines: int, marks: Optional[tuple]) -> Dict[str, Any]:
+    """
+    测量整篇重新着色的耗时
+    :param text:
+    :param lines:
+    :param marks: register_highlights的参数，为None时不加标记
+    :return:
+    """
+    document = _new_document(text)
+    highlighter = _new_highlighter(document, marks)
+    PythonHighlighter.span_cache.clear()
+    t0 = time.perf_counter()
+    highlighter.rehighlight()
+    cold = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    highlighter.rehighlight()
+    warm = time.perf_counter() - t0
+    cache = PythonHighlighter.span_cache.stats()
+    highlighter.setDocument(None)
+    return {'cold_seconds': cold, 'warm_seconds': warm,
+            'cold_lines_per_second': lines / cold, 'warm_lines_per_second': lines / warm,
+            'cold_chars_per_second': len(text) / cold, 'cache_hit_rate': cache['hit_rate']}
+
+
+def bench_keystrokes(app: QApplication, text: str, lines: int, marks: Optional[tuple], lazy: bool,
+                     samples: int, seed: int = 0) -> Dict[str, Any]:
+    """
+    测量单次按键后重新着色的耗时。每次按键之后撤销，文档恢复原样。
+    :param app:
+    :param text:
+    :param lines:
+    :param marks:
+    :param lazy: 是否使用懒惰模式
+    :param samples: 按键次数
+    :param seed:
+    :return:
+    """
+    document = _new_document(text)
+    highlighter = _new_highlighter(document, marks, lazy)
+    highlighter.rehighlight()
+    while highlighter.is_pending():
+        app.processEvents()
+    rng = random.Random(seed)
+    cursor = QTextCursor(document)
+
+    def press(line: int, key: str, column: int = 4) -> float:
+        block = document.findBlockByNumber(line)
+        highlighter.set_visible_range(line - VISIBLE_MARGIN, line + VISIBLE_MARGIN)
+        cursor.setPosition(block.position() + min(column, block.length() - 1))
+        t0 = time.perf_counter()
+        cursor.insertText(key)
+        return time.perf_counter() - t0
+
+    times = []
+    for _ in range(samples):
+        times.append(press(rng.randrange(lines), 'x'))
+        document.undo()
+    result = _latency_stats(times)
+    while highlighter.is_pending():
+        app.processEvents()
+    line = _cascade_line(document, highlighter, lines // 10)
+    result['cascade_ms'] = press(line, '"""', column=0) * 1e3
+    result['cascade_line'] = line
+    state = highlighter.block_state(line)
+    # 否则测到的只是一次普通按键
+    assert state is not None and state.mode == STATE_TRIPLEDOUBLE, \
+        'cascade edit at line %d did not open a string' % line
+    document.undo()
+    while highlighter.is_pending():
+        app.processEvents()
+    line = _code_line(document, highlighter, lines // 10)
+    result['bracket_ms'] = press(line, '(', column=sys.maxsize) * 1e3
+    highlighter.setDocument(None)
+    return result
+
+
+def bench_memory(text: str, marks: Optional[tuple]) -> Dict[str, Any]:
+    """
+    测量整篇着色时Python分配内存的峰值。tracemalloc会使速度明显变慢，所以与计时分开进行。
+    :param text:
+    :param marks:
+    :return:
+    """
+    PythonHighlighter.span_cache.clear()
+    tracemalloc.start()
+    try:
+        document = _new_document(text)
+        highlighter = _new_highlighter(document, marks)
+        highlighter.rehighlight()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    highlighter.setDocument(None)
+    return {'python_peak_mb': peak / 2 ** 20, 'python_retained_mb': current / 2 ** 20,
+            'process_max_rss_kb': _max_rss_kb()}
+
+
+def run(sizes: List[int], kinds: List[str], keystrokes: int, memory: bool) -> Dict[str, Any]:
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = []
+    for kind in kinds:
+        for lines in sizes:
+            text = corpus.generate(kind, lines)
+            marks = corpus.generate_marks(lines) if kind == 'marked' else None
+            case = {'kind': kind, 'lines': lines, 'chars': len(text),
+                    'rehighlight': bench_rehighlight(text, lines, marks),
+                    'keystroke': {'eager': bench_keystrokes(app, text, lines, marks, False, keystrokes),
+                                  'lazy': bench_keystrokes(app, text, lines, marks, True, keystrokes)}}
+            if memory:
+                case['memory'] = bench_memory(text, marks)
+            results.append(case)
+            print('%-13s %8d lines  rehighlight %7.2f s (%9.0f lines/s)  keystroke p50 %6.2f ms  '
+                  'cascade %8.1f ms  bracket %8.1f ms%s' % (
+                      kind, lines, case['rehighlight']['cold_seconds'],
+                      case['rehighlight']['cold_lines_per_second'], case['keystroke']['eager']['p50_ms'],
+                      case['keystroke']['eager']['cascade_ms'], case['keystroke']['eager']['bracket_ms'],
+                      '  peak %.1f MB' % case['memory']['python_peak_mb'] if memory else ''))
+            sys.stdout.flush()
+    return {'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'qt_api': API_NAME, 'qt_version': QT_VERSION,
+                            'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+            'results': results}
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Headless benchmarks of PythonHighlighter.')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated line counts (default: %(default)s)')
+    parser.add_argument('--kinds', default=','.join(corpus.KINDS),
+                        help='comma separated corpus kinds (default: %(default)s)')
+    parser.add_argument('--keystrokes', type=int, default=20, help='keystroke samples per case')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--output', default='highlighter_benchmark.json', help='JSON result file')
+    args = parser.parse_args(argv)
+    results = run([int(size) for size in args.sizes.split(',')], args.kinds.split(','), args.keystrokes,
+                  not args.no_memory)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print('results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/10 9:30
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: corpus.py
+"""
+生成用于性能测试的合成Python代码。
+
+同样的参数总是生成同样的文本，不同机器上的结果可以直接比较。
+typical: 普通的函数和类；long_lines: 每隔一段有一行数千字符的数据；
+triple_quoted: 大量跨越数百行的三引号字符串，其中还混有另一种引号；
+marked: 与typical相同的文本，另外为每行生成若干个标记，见generate_marks。
+"""
+import random
+from array import array
+from typing import List, Tuple
+
+KINDS = ('typical', 'long_lines', 'triple_quoted', 'marked')
+
+_NAMES = ['value', 'result', 'items', 'index', 'data', 'config', 'widget', 'path', 'count', 'buffer']
+_CALLS = ['len', 'range', 'isinstance', 'sorted', 'max', 'min', 'print', 'open', 'getattr', 'zip']
+
+
+def _statement(rng: random.Random) -> str:
+    name = rng.choice(_NAMES)
+    kind = rng.randrange(8)
+    if kind == 0:
+        return '%s = %s(%s) + %d  # %s' % (name, rng.choice(_CALLS), rng.choice(_NAMES), rng.randrange(1000),
+                                          'update the %s' % rng.choice(_NAMES))
+    elif kind == 1:
+        return "%s = '%s' + \"%s\"" % (name, rng.choice(_NAMES) * 2, rng.choice(_NAMES))
+    elif kind == 2:
+        return 'if %s is not None and %s > %.2f:' % (name, rng.choice(_NAMES), rng.random() * 100)
+    elif kind == 3:
+        return 'for %s in %s(%d):' % (name, rng.choice(_CALLS), rng.randrange(100))
+    elif kind == 4:
+        return 'return [%s for %s in %s if %s]' % (name, name, rng.choice(_NAMES), rng.choice(['True', 'False']))
+    elif kind == 5:
+        return 'self.%s = {%r: %d, %r: None}' % (name, rng.choice(_NAMES), rng.randrange(10), rng.choice(_NAMES))
+    elif kind == 6:
+        return 'raise ValueError("unexpected %s: %%s" %% %s)' % (name, name)
+    return 'pass'
+
+
+def _typical_block(rng: random.Random, out: List[str]):
+    out.append('@staticmethod' if rng.random() < 0.2 else '')
+    out.append('def %s_%d(%s, %s=None):' % (rng.choice(_NAMES), rng.randrange(10000), rng.choice(_NAMES),
+                                            rng.choice(_NAMES)))
+    out.append('    """Compute the %s."""' % rng.choice(_NAMES))
+    for _ in range(rng.randrange(4, 16)):
+        out.append('    ' + _statement(rng))
+    out.append('')
+
+
+def _long_line(rng: random.Random, length: int) -> str:
+    parts = []
+    size = 0
+    while size < length:
+        part = rng.choice(['%d' % rng.randrange(100000), '%r' % rng.choice(_NAMES), '%.3f' % rng.random(), 'None'])
+        parts.append(part)
+        size += len(part) + 2
+    return 'DATA_%d = [%s]' % (rng.randrange(1000), ', '.join(parts))
+
+
+def _triple_quoted_block(rng: random.Random, out: List[str], depth: int):
+    quote = rng.choice(['"""', "'''"])
+    other = "'''" if quote == '"""' else '"""'
+    out.append('TEMPLATE_%d = %s' % (rng.randrange(10000), quote))
+    for i in range(depth):
+        if i % 7 == 0:
+            out.append('    nested %s not closing here %s' % (other, rng.choice(_NAMES)))
+        else:
+            out.append('    ' + _statement(rng))
+    out.append(quote)
+    out.append('')
+
+
+def generate(kind: str, lines: int, seed: int = 0, long_line_length: int = 5000, long_line_every: int = 50,
+             string_depth: int = 300) -> str:
+    """
+    生成合成代码
+    :param kind: KINDS中的一种
+    :param lines: 行数
+    :param seed: 随机数种子
+    :param long_line_length: long_lines中长行的长度
+    :param long_line_every: long_lines中每隔多少行出现一个长行
+    :param string_depth: triple_quoted中每个三引号字符串的行数
+    :return:
+    """
+    if kind not in KINDS:
+        raise ValueError('unrecognized corpus kind %r' % kind)
+    rng = random.Random(seed)
+    out = ['# -*- coding:utf-8 -*-', 'import os', 'import sys', '']
+    next_long_line = long_line_every
+    while len(out) < lines:
+        if kind == 'long_lines' and len(out) >= next_long_line:
+            out.append(_long_line(rng, long_line_length))
+            next_long_line += long_line_every
+        if kind == 'triple_quoted' and rng.random() < 0.5:
+            _triple_quoted_block(rng, out, string_depth)
+        else:
+            _typical_block(rng, out)
+    return '\n'.join(out[:lines])
+
+
+def generate_marks(lines: int, per_line: int = 3, seed: int = 0) \
+        -> Tuple[array, array, array, array, array, List[str]]:
+    """
+    生成标记，列的格式与PythonHighlighter.register_highlights的参数一致
+    :param lines: 文档的行数
+    :param per_line: 每行的标记数
+    :param seed:
+    :return: (行号，起始列，长度，种类，提示文字下标，提示文字)
+    """
+    rng = random.Random(seed)
+    hints = ['E%03d synthetic diagnostic' % i for i in range(100)]
+    columns = tuple(array('i') for _ in range(5))  # 一百万行时有数百万个标记，用array而不是list
+    for line in range(lines):
+        for _ in range(per_line):
+            columns[0].append(line)
+            columns[1].append(rng.randrange(40))
+            columns[2].append(rng.choice([-1, 1, 4, 10]))
+            columns[3].append(rng.choice([1, 2, 3, 4]))
+            columns[4].append(rng.randrange(len(hints)))
+    return columns + (hints,)
@@ -9,7 +9,9 @@ Package implementing various functions/classes needed everywhere within eric6.
 import os
 import re
 from codecs import BOM_UTF8, BOM_UTF16, BOM_UTF32
-from .autocomp import AutoCompThread
+from .autocomp import AutoCompThread, CompletionCache, DetailCache
+from .completionpool import CompletionProcessPool
+from .fuzzy import FuzzyIndex
 try:
     EXTSEP = os.extsep
 except AttributeError:
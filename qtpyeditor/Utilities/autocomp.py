@@ -4,69 +4,539 @@
 # @Email: 1295752786@qq.com
 # @File: autocomp.py
 import re
-import time
+import threading
 import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
 from qtpy.QtCore import QThread, Signal
 
+from qtpyeditor.Utilities.completionpool import Completion
+from qtpyeditor.Utilities.fuzzy import FuzzyIndex
+from qtpyeditor.Utilities.jediworker import completion_records, completion_detail, completion_types, \
+    find_project
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
 class AutoCompThread(QThread):
     '''
-    当一段时间没有补全需求之后，后台自动补全线程会进入休眠模式。下一次补全请求则会唤醒该后台线程。
+    后台自动补全线程。没有补全请求时在条件变量上等待，不占用CPU；request()提交请求后立即唤醒。
+    每个请求带有文档的修订号。连续按键产生的多个请求只保留最新的一个，已经过时的请求不会交给jedi；
+    jedi返回时如果已经有了更新的请求，结果也直接丢弃，不发出信号。
+    trigger发出的元组为(行，列，触发时的hint，修订号)，以及由补全结果建立的fuzzy.FuzzyIndex。
+    hint是标识符时，jedi在标识符的开头补全，得到不经过滤的全部候选项，由编辑器按hint做模糊匹配和排序；
+    否则（比如字符串中的路径）在光标处补全，候选项由jedi过滤。
+
+    请求中带有文件路径时，jedi按路径使用自己的模块缓存，并在文件所在的工程中解析导入（包括相对导入）。
+    工程根目录由jedi.get_default_project按setup.py、.git等标志查找，每个根目录只创建一个jedi.Project，
+    所有编辑器共用。
+
+    use_process_pool为True时，jedi在completionpool.CompletionProcessPool的工作进程中运行。
+    两种方式的补全结果都是completionpool.Completion记录，界面线程不接触jedi的对象，不会在界面线程中做推断。
+
+    线程自己保存一份文档的副本（text），由编辑器通过reset_text()和apply_change()同步，
+    后者只传递一次修改的位置、删除的字符数和插入的文本，所以请求补全时不必复制全文。
+    副本只在本线程中读写，修改在处理下一个请求之前按顺序应用。
+
+    warm_up()让线程在空闲时预先分析一些模块（WARMUP_MODULES和当前文件导入的模块），
+    这样第一次在numpy.、pandas.之后补全时不必等待jedi冷启动。预热每次只分析一个模块，
+    有补全请求时先处理请求。每分析完一个模块发出一次warmup_progress信号(已完成数，总数，模块名)。
+    预热和下面的补求type是用户没有直接请求的后台工作，在本线程中运行jedi时会与界面线程争夺GIL，
+    所以默认只在进程池中进行；background_in_thread为True时在本线程中也进行。
+
+    request_detail()请求求出一个候选项的签名和文档，同样在补全请求之后处理，之后文档又改变时作废。
+    结果由detail_ready信号发出(候选项，签名，文档)。
+
+    为了不让jedi冷启动拖慢补全，每次补全只在TYPE_BUDGET秒内求type，其余候选项的type为None。
+    编辑器通过request_types()请求补全列表中可见的几行缺少的type，列表关闭时用cancel_types()取消；
+    求文档时如果候选项的type为None，也一并求出。求出的type由types_ready信号发出{(name, full_name): type}，
+    编辑器据此补上缓存的候选项和补全列表中的type（见fill_types）。
     '''
-    trigger = Signal(tuple, list)
+    trigger = Signal(tuple, object)
+    warmup_progress = Signal(int, int, str)
+    detail_ready = Signal(object, str, str)
+    types_ready = Signal(object)
+
+    TYPE_BUDGET = 0.05  # 每次补全求type的时间上限（秒），见jediworker.completion_records
+    WARMUP_MODULES: List[str] = []  # 总是预热的模块
+    WARMUP_MAX_MODULES = 20  # 每次预热最多分析的模块数
+    _warmed_modules: Set[str] = set()  # 已经预热过的模块，所有线程共用
+
+    cache_directory: Optional[str] = None  # jedi的缓存目录，为None时使用jedi的默认值
+    use_process_pool = False  # 是否在独立的进程中运行jedi，需要在线程启动前设置
+    background_in_thread = False  # 不使用进程池时，是否也在本线程中预热和补求type
+    _projects: Dict[str, 'jedi.Project'] = {}  # 工程根目录 -> jedi.Project
+    _project_dirs: Dict[str, str] = {}  # 文件所在目录 -> 工程根目录
+    _projects_lock = threading.Lock()
 
     def __init__(self):
         super(AutoCompThread, self).__init__()
-        self.text = ''
+        self.text = ''  # 文档的副本
         self.text_cursor_pos = (0, 1)
-        self.activated = True
         self.stop_flag = False
+        self._condition = threading.Condition()
+        self.revision = -1  # 最新请求的修订号
+        self._request: Optional[Tuple[int, Tuple[int, int], str, str]] = None
+        self._reset_text: Optional[str] = None
+        self._changes: List[Tuple[int, int, str]] = []
+        self._warmup_request: Optional[Tuple[List[str], str]] = None  # (模块名，文件路径)
+        self._warmup_queue: List[str] = []
+        self._warmup_done = 0
+        self._warmup_path = ''
+        self._detail_request: Optional[Tuple[Tuple[int, int], str, str, Completion]] = None
+        # 补求type的请求：(光标位置，文件路径，hint，[(name, full_name)])
+        self._type_request: Optional[Tuple[Tuple[int, int], str, str, List[Tuple[str, Optional[str]]]]] = None
+        self._pool = None  # 使用的completionpool.CompletionProcessPool
+        self._thread_id = 0  # 本线程的threading.get_ident()，用于中止进程池中的请求
 
-    def run(self):
-        text = ''
-        last_complete_time = time.time()
+    @classmethod
+    def set_cache_directory(cls, path: Optional[str]):
+        """
+        设置jedi的缓存目录（解析结果的pickle缓存）。为None时恢复jedi的默认值。
+        :param path:
+        :return:
+        """
+        cls.cache_directory = path
         try:
             import jedi
         except ImportError:
-            print('Jedi not installed.install jedi for better auto-completion!')
             return
-        while (1):
-            if self.stop_flag:
-                return
+        cls._apply_settings(jedi)
 
-            if self.text == text:
-                if time.time() - last_complete_time >= 30:
-                    self.activated = False
-                time.sleep(0.02 if self.activated else 0.1)
-                continue
+    @classmethod
+    def _apply_settings(cls, jedi):
+        if cls.cache_directory is not None:
+            jedi.settings.cache_directory = cls.cache_directory
+
+    @classmethod
+    def get_project(cls, path: str) -> Optional['jedi.Project']:
+        """
+        返回文件所在工程的jedi.Project，同一个根目录只创建一次
+        :param path: 文件路径，为空时返回None
+        :return:
+        """
+        with cls._projects_lock:
+            return find_project(path, cls._projects, cls._project_dirs)
+
+    def reset_text(self, text: str):
+        """
+        用全文替换文档副本，之前尚未应用的修改和请求全部作废
+        :param text:
+        :return:
+        """
+        with self._condition:
+            self._reset_text = text
+            self._changes = []
+            self._request = None
+            self._detail_request = None
+            self._condition.notify()
+
+    def apply_change(self, position: int, chars_removed: int, text_added: str):
+        """
+        把一次修改同步到文档副本，参数与QTextDocument.contentsChange一致。尚未开始处理的请求随之作废。
+        :param position:
+        :param chars_removed:
+        :param text_added: 插入的文本，换行符为\\n
+        :return:
+        """
+        with self._condition:
+            self._changes.append((position, chars_removed, text_added))
+            self._request = None  # 请求之后文档又发生了改变，请求已经过时
+            self._detail_request = None
+            self._condition.notify()
+
+    def request(self, revision: int, text_cursor_pos: Tuple[int, int], path: str = '', hint: str = ''):
+        """
+        提交一次补全请求。尚未开始处理的旧请求会被直接替换。
+        :param revision: 文档的修订号，即QTextDocument.revision()
+        :param text_cursor_pos: 光标位置(行，列)，行号从1开始，与jedi一致
+        :param path: 文件路径，新建尚未保存的文件为空
+        :param hint: 光标前正在输入的标识符
+        :return:
+        """
+        with self._condition:
+            self.text_cursor_pos = text_cursor_pos
+            self.revision = revision
+            self._request = (revision, text_cursor_pos, path, hint)
+            self._condition.notify()
+
+    def request_detail(self, text_cursor_pos: Tuple[int, int], path: str, hint: str, completion: Completion):
+        """
+        请求求出候选项的签名和文档。尚未开始处理的旧请求会被直接替换。
+        :param text_cursor_pos: 光标位置(行，列)，与request()相同
+        :param path:
+        :param hint: 光标前正在输入的标识符
+        :param completion: 补全列表中选中的候选项
+        :return:
+        """
+        with self._condition:
+            self._detail_request = (text_cursor_pos, path, hint, completion)
+            self._condition.notify()
+
+    @classmethod
+    def runs_background_jobs(cls) -> bool:
+        """
+        是否进行预热和补求type等后台工作，见background_in_thread
+        :return:
+        """
+        return cls.use_process_pool or cls.background_in_thread
+
+    def request_types(self, text_cursor_pos: Tuple[int, int], path: str, hint: str, completions: Sequence[Completion]):
+        """
+        请求求出候选项缺少的type，一般是补全列表中可见的几行。尚未开始处理的旧请求会被直接替换。
+        runs_background_jobs()为False时不做任何事。
+        :param text_cursor_pos: 光标位置(行，列)，与request()相同
+        :param path:
+        :param hint: 光标前正在输入的标识符
+        :param completions: type为None的候选项
+        :return:
+        """
+        if not self.runs_background_jobs():
+            return
+        with self._condition:
+            self._type_request = (text_cursor_pos, path, hint, [(c.name, c.full_name) for c in completions])
+            self._condition.notify()
+
+    def cancel_types(self):
+        """
+        取消尚未开始处理的补求type的请求，补全列表关闭时调用
+        :return:
+        """
+        with self._condition:
+            self._type_request = None
+
+    def warm_up(self, modules: Sequence[str] = (), path: str = ''):
+        """
+        请求预热。要分析的模块为WARMUP_MODULES、modules以及文档副本中顶层导入的模块，已经预热过的模块跳过。
+        runs_background_jobs()为False时不做任何事。
+        :param modules:
+        :param path: 当前文件的路径，用于确定工程和导入路径
+        :return:
+        """
+        if not self.runs_background_jobs():
+            return
+        with self._condition:
+            self._warmup_request = (list(modules), path)
+            self._condition.notify()
+
+    @staticmethod
+    def find_imports(text: str) -> List[str]:
+        """
+        找出代码中顶层的绝对导入，比如import numpy as np、from pandas.io import sql
+        :param text:
+        :return: 模块名，按出现的顺序，没有重复
+        """
+        modules = []
+        for match in re.finditer(r'^(?:from\s+([A-Za-z_][\w.]*)\s+import\b|import\s+([^#;\n]+))', text, re.M):
+            if match.group(1):
+                names = [match.group(1)]
+            else:
+                names = [name.split(' as ')[0].strip() for name in match.group(2).split(',')]
+            for name in names:
+                if re.match(r'^[A-Za-z_][\w.]*$', name) and name not in modules:
+                    modules.append(name)
+        return modules
+
+    def _start_warm_up(self, modules: List[str], path: str):
+        queue = []
+        for name in self.WARMUP_MODULES + modules + self.find_imports(self.text):
+            if name not in self._warmed_modules and name not in queue:
+                queue.append(name)
+        self._warmup_queue = queue[:self.WARMUP_MAX_MODULES]
+        self._warmup_done = 0
+        self._warmup_path = path
+
+    def _warm_up_next(self, jedi, pool):
+        name = self._warmup_queue.pop(0)
+        # 补全模块的全部属性并求出type，jedi会解析并推断该模块，结果留在进程内的缓存中。
+        code = 'import %s\n%s.' % (name, name)
+        try:
+            self._complete(jedi, pool, code, (2, len(name) + 1), self._warmup_path, -1, background=True)
+        except Exception:
+            logger.debug('warm up %s failed' % name, exc_info=True)
+        if self.stop_flag:  # 中途退出，没有分析完
+            return
+        self._warmed_modules.add(name)
+        self._warmup_done += 1
+        self.warmup_progress.emit(self._warmup_done, self._warmup_done + len(self._warmup_queue), name)
+
+    def _complete(self, jedi, pool, text: str, text_cursor_pos: Tuple[int, int], path: str,
+                  type_budget: float, should_stop: Callable[[], bool] = None,
+                  background: bool = False) -> List[Completion]:
+        """
+        :param should_stop: 在本线程中运行jedi时，每求一个type之前调用，返回True时不再求type。默认检查stop_flag
+        :param background: 是否为后台请求，在进程池中排在交互请求后面
+        """
+        if pool is not None:
+            return pool.complete(text, text_cursor_pos, path, type_budget, background)
+        script = jedi.Script(text, path=path or None, project=self.get_project(path))
+        records = completion_records(script.complete(*text_cursor_pos), type_budget,
+                                     should_stop or (lambda: self.stop_flag))
+        return [Completion(*record) for record in records]
+
+    def _has_pending_work(self) -> bool:
+        """
+        是否有补全请求、文档请求或者文档的修改等待处理，在本线程中补求type时据此中断
+        :return:
+        """
+        with self._condition:
+            return self.stop_flag or self._request is not None or self._detail_request is not None or \
+                   bool(self._changes) or self._reset_text is not None
+
+    def _handle_types(self, jedi, pool, text_cursor_pos: Tuple[int, int], path: str, hint: str,
+                      keys: List[Tuple[str, Optional[str]]]):
+        pos = self.completion_pos(text_cursor_pos, hint)
+        try:
+            if pool is not None:
+                types = pool.types(self.text, pos, path, keys)
+            else:
+                script = jedi.Script(self.text, path=path or None, project=self.get_project(path))
+                types = {(name, full_name): type_ for name, full_name, type_ in
+                         completion_types(script.complete(*pos), keys, self._has_pending_work)}
+        except Exception:
+            logger.debug('resolving completion types failed', exc_info=True)
+            return
+        types = {key: type_ for key, type_ in types.items() if type_}
+        if types and not self.stop_flag:
+            self.types_ready.emit(types)
 
+    def _detail(self, jedi, pool, text: str, text_cursor_pos: Tuple[int, int], path: str,
+                name: str) -> Tuple[str, str, Optional[str]]:
+        if pool is not None:
+            return pool.detail(text, text_cursor_pos, path, name)
+        script = jedi.Script(text, path=path or None, project=self.get_project(path))
+        return completion_detail(script.complete(*text_cursor_pos), name)
+
+    @staticmethod
+    def completion_pos(text_cursor_pos: Tuple[int, int], hint: str) -> Tuple[int, int]:
+        """
+        hint是标识符时，在标识符的开头补全，得到全部候选项；否则在光标处补全
+        :param text_cursor_pos:
+        :param hint:
+        :return:
+        """
+        row, col = text_cursor_pos
+        return (row, col - len(hint)) if hint.isidentifier() else (row, col)
+
+    def _sync_text(self, reset_text: Optional[str], changes: List[Tuple[int, int, str]]):
+        if reset_text is not None:
+            self.text = reset_text
+        text = self.text
+        for position, chars_removed, text_added in changes:
+            text = text[:position] + text_added + text[position + chars_removed:]
+        self.text = text
+
+    def run(self):
+        jedi = pool = None
+        if self.use_process_pool:
+            from qtpyeditor.Utilities.completionpool import CompletionProcessPool
+            pool = CompletionProcessPool.instance()
+        else:
             try:
-                row_text = self.text.splitlines()[self.text_cursor_pos[0] - 1]
-                hint = re.split(
-                    '[.:;,?!\s \+ \- = \* \\ \/  \( \)\[\]\{\} ]', row_text)[-1]
-                content = (
-                    self.text_cursor_pos[0], self.text_cursor_pos[1], hint
-                )
-                logger.debug('Text of current row:%s' % content[2])
-                script = jedi.Script(self.text)
-                l = script.complete(*self.text_cursor_pos)
+                import jedi
+            except ImportError:
+                print('Jedi not installed.install jedi for better auto-completion!')
+                return
+            self._apply_settings(jedi)
+        self._pool = pool
+        self._thread_id = threading.get_ident()
+        while True:
+            with self._condition:
+                while self._request is None and self._reset_text is None and not self._changes \
+                        and self._warmup_request is None and not self._warmup_queue \
+                        and self._detail_request is None and self._type_request is None and not self.stop_flag:
+                    self._condition.wait()
+                if self.stop_flag:
+                    return
+                reset_text, changes, request = self._reset_text, self._changes, self._request
+                warmup_request = self._warmup_request
+                self._reset_text, self._changes, self._request, self._warmup_request = None, [], None, None
+            self._sync_text(reset_text, changes)
+            if warmup_request is not None:
+                self._start_warm_up(*warmup_request)
+            if request is None:
+                with self._condition:
+                    detail_request, self._detail_request = self._detail_request, None
+                    type_request = self._type_request if detail_request is None else None
+                    if type_request is not None:
+                        self._type_request = None
+                if detail_request is not None:  # 补全请求优先，之后才求文档，再之后补求type
+                    self._handle_detail(jedi, pool, *detail_request)
+                elif type_request is not None:
+                    self._handle_types(jedi, pool, *type_request)
+                elif self._warmup_queue:  # 没有补全请求时才预热，每次一个模块
+                    self._warm_up_next(jedi, pool)
+                continue
+            revision, text_cursor_pos, path, hint = request
+            text = self.text
+            content = (text_cursor_pos[0], text_cursor_pos[1], hint, revision)
+            try:
+                logger.debug('Hint:%s' % hint)
+                l = self._complete(jedi, pool, text, self.completion_pos(text_cursor_pos, hint), path,
+                                   self.TYPE_BUDGET)
 
             except:
                 import traceback
                 traceback.print_exc()
                 l = []
-            self.trigger.emit(content, l)
-            last_complete_time = time.time()
+            if self.is_stale(revision, text_cursor_pos):
+                continue
+            index = FuzzyIndex(l)
+            if self.is_stale(revision, text_cursor_pos):
+                continue
+            self.trigger.emit(content, index)
 
-            self.activated = True
-            text = self.text
+    def _handle_detail(self, jedi, pool, text_cursor_pos: Tuple[int, int], path: str, hint: str,
+                       completion: Completion):
+        try:
+            signature, docstring, type_ = self._detail(jedi, pool, self.text,
+                                                       self.completion_pos(text_cursor_pos, hint), path,
+                                                       completion.name)
+        except:
+            import traceback
+            traceback.print_exc()
+            return
+        with self._condition:
+            if self._changes or self._reset_text is not None:  # 求文档期间文档又改变了
+                return
+        if completion.type is None and type_:
+            self.types_ready.emit({(completion.name, completion.full_name): type_})
+        self.detail_ready.emit(completion, signature, docstring)
+
+    def is_stale(self, revision: int, text_cursor_pos: Tuple[int, int]) -> bool:
+        """
+        判断请求是否已经被更新的请求或者之后的修改取代
+        :param revision:
+        :param text_cursor_pos:
+        :return:
+        """
+        with self._condition:
+            return self._request is not None or self._changes or self._reset_text is not None or \
+                   revision != self.revision or text_cursor_pos != self.text_cursor_pos
 
     def on_exit(self):
-        self.stop_flag = True
-        self.exit(0)
-        if self.isRunning():
-            self.quit()
-        self.wait(500)
+        """
+        结束线程并等待线程退出。jedi在工作进程中处理请求（比如预热一个大模块）时，中止该请求；
+        在本线程中运行jedi时，每求一个type之前检查stop_flag，只需等待当前的script.complete()完成。
+        :return:
+        """
+        with self._condition:
+            self.stop_flag = True
+            self._condition.notify()
+        while not self.wait(50):
+            if self._pool is not None:
+                self._pool.cancel(self._thread_id)
+
+
+def fill_types(completions: List[Completion], types: Dict[Tuple[str, Optional[str]], str]) -> List[int]:
+    """
+    用AutoCompThread.types_ready发出的type补上type为None的候选项，直接修改列表
+    :param completions:
+    :param types: {(name, full_name): type}
+    :return: 修改了的候选项的序号
+    """
+    changed = []
+    for i, c in enumerate(completions):
+        if c.type is None:
+            type_ = types.get((c.name, c.full_name))
+            if type_ is not None:
+                completions[i] = c._replace(type=type_)
+                changed.append(i)
+    return changed
+
+
+class CompletionCache(object):
+    """
+    缓存最近一次jedi在标识符开头给出的全部候选项（fuzzy.FuzzyIndex）。
+
+    光标仍在同一个标识符中时，无论继续输入还是退格，都直接在缓存中按当前的hint做模糊匹配和排序，不必再请求jedi。
+    缓存以标识符在文档中的起始位置为键；标识符之外的任何修改都会使缓存失效（见on_contents_change）。
+    匹配和排序规则见fuzzy模块，比如rdcsv可以匹配read_csv。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self.start = -1  # 标识符的起始位置，-1表示缓存为空
+        self.end = -1  # 标识符的结束位置
+        self.index: Optional[FuzzyIndex] = None
+
+    def store(self, start: int, hint: str, index: FuzzyIndex):
+        """
+        保存jedi在标识符开头给出的候选项
+        :param start: 标识符在文档中的起始位置
+        :param hint: 收到结果时标识符的内容
+        :param index:
+        :return:
+        """
+        self.start = start
+        self.end = start + len(hint)
+        self.index = index
+
+    def lookup(self, start: int, hint: str) -> Optional[List]:
+        """
+        在缓存中找出与hint模糊匹配的候选项，按得分排序
+        :param start: 标识符在文档中的起始位置
+        :param hint: 当前标识符的内容
+        :return: 不能由缓存得到结果时返回None
+        """
+        if self.index is None or start != self.start or not (hint == '' or hint.isidentifier()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.end = start + len(hint)
+        return self.index.match(hint)
+
+    def fill_types(self, types: Dict[Tuple[str, Optional[str]], str]):
+        """
+        补上缓存的候选项中尚未求出的type，见AutoCompThread.types_ready
+        :param types:
+        :return:
+        """
+        if self.index is not None:
+            fill_types(self.index.candidates, types)
+
+    def on_contents_change(self, position: int):
+        """
+        文档内容改变时调用。修改发生在缓存的标识符之外时，清空缓存。
+        :param position: 修改的位置
+        :return:
+        """
+        if self.start >= 0 and not self.start <= position <= self.end:
+            self.clear()
+
+
+class DetailCache(object):
+    """
+    候选项签名和文档的LRU缓存，以候选项的完整名称（Completion.full_name）为键。
+    没有完整名称的候选项（比如局部变量）不缓存，因为同名的变量在不同的作用域中含义不同。
+    """
+    MAX_ENTRIES = 256
+
+    def __init__(self):
+        self._entries: 'OrderedDict[str, Tuple[str, str]]' = OrderedDict()
+
+    def get(self, completion: Completion) -> Optional[Tuple[str, str]]:
+        """
+        :param completion:
+        :return: (签名，文档)，没有缓存时返回None
+        """
+        if not completion.full_name:
+            return None
+        detail = self._entries.get(completion.full_name)
+        if detail is not None:
+            self._entries.move_to_end(completion.full_name)
+        return detail
+
+    def put(self, completion: Completion, signature: str, docstring: str):
+        if not completion.full_name:
+            return
+        self._entries[completion.full_name] = (signature, docstring)
+        self._entries.move_to_end(completion.full_name)
+        while len(self._entries) > self.MAX_ENTRIES:
+            self._entries.popitem(last=False)
@@ -0,0 +1,227 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/11 10:05
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: completionpool.py
+"""
+在独立的进程中运行jedi，所有编辑器共用一个进程池。
+
+jedi的推断不再与界面争夺GIL，jedi崩溃或者内存暴涨也不会拖垮编辑器。补全结果以Completion记录返回，
+只包含name、type、complete和full_name四个字段，与jedi.api.classes.Completion中编辑器用到的属性同名，type可能为None
+（见jediworker.completion_records）。选中的候选项的签名和文档由detail()另外求得，同时求出type；
+可见的几行中缺少的type由types()求得。
+工作进程的峰值内存超过MEMORY_LIMIT_MB后会在回复后退出，进程池随即启动一个新的进程补上。
+无法取得峰值内存时（见jediworker.max_rss_kb），改为每处理RESTART_AFTER_REQUESTS个请求重新启动一次。
+complete()会阻塞直到有空闲进程并得到结果，只能在后台线程（AutoCompThread）中调用。
+预热、补求type等后台请求（background=True）只在没有交互请求等待时才取得空闲进程，
+只有一个工作进程时，一个编辑器的预热不会排在其他编辑器的补全前面。
+"""
+import atexit
+import logging
+import os
+import subprocess
+import sys
+import threading
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+from qtpyeditor.Utilities.jediworker import read_message, write_message
+
+logger = logging.getLogger(__name__)
+
+Completion = namedtuple('Completion', ['name', 'type', 'complete', 'full_name'], defaults=(None,))
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jediworker.py')
+
+
+class CompletionWorker(object):
+    """
+    一个补全工作进程
+    """
+
+    def __init__(self, memory_limit_mb: int, cache_directory: Optional[str]):
+        self.memory_limit_mb = memory_limit_mb
+        self.cache_directory = cache_directory
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+        self.requests = 0  # 本次启动以来处理的请求数
+
+    def start(self):
+        args = [sys.executable, WORKER_SCRIPT, str(self.memory_limit_mb)]
+        if self.cache_directory:
+            args.append(self.cache_directory)
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.requests = 0
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def call(self, kind: str, text: str, row: int, col: int, path: str, arg) -> Tuple[tuple, int]:
+        """
+        发送请求并等待回复
+        :param kind: 'complete'或'detail'，见jediworker
+        :return: (结果, 工作进程的峰值内存kB)
+        :raise EOFError, OSError: 工作进程已经退出
+        """
+        write_message(self.process.stdin, (kind, text, row, col, path, arg))
+        reply = read_message(self.process.stdout)
+        if reply is None:
+            raise EOFError('completion worker exited')
+        self.requests += 1
+        return reply
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process.stdout.close()
+        self.process = None
+
+
+class CompletionProcessPool(object):
+    WORKERS = 1  # 工作进程数，多个编辑器同时补全时才需要多于1个
+    MEMORY_LIMIT_MB = 1024  # 工作进程峰值内存的上限，为0时不限制
+    RESTART_AFTER_REQUESTS = 500  # 无法取得峰值内存时，工作进程每处理这么多请求重新启动一次
+
+    _instance: Optional['CompletionProcessPool'] = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> 'CompletionProcessPool':
+        """
+        返回进程范围内共享的进程池，第一次调用时启动工作进程
+        :return:
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                from qtpyeditor.Utilities.autocomp import AutoCompThread
+                cls._instance = cls(cls.WORKERS, cls.MEMORY_LIMIT_MB, AutoCompThread.cache_directory)
+                atexit.register(cls._instance.shutdown)
+            return cls._instance
+
+    def __init__(self, workers: int, memory_limit_mb: int, cache_directory: Optional[str] = None):
+        self.workers = [CompletionWorker(memory_limit_mb, cache_directory) for _ in range(workers)]
+        self._idle: List[CompletionWorker] = []
+        self._idle_condition = threading.Condition()
+        self._waiting = 0  # 正在等待空闲进程的交互请求数
+        self._busy: Dict[int, CompletionWorker] = {}  # 线程id -> 正在为该线程处理请求的工作进程
+        self._busy_lock = threading.Lock()
+        self._rss_warned = False
+        for worker in self.workers:
+            worker.start()  # 提前启动，工作进程在等待第一个请求时就完成了jedi的导入
+            self._idle.append(worker)
+
+    def complete(self, text: str, text_cursor_pos: Tuple[int, int], path: str = '',
+                 type_budget: float = -1, background: bool = False) -> List[Completion]:
+        """
+        在空闲的工作进程中补全。工作进程崩溃时返回空列表，并重新启动该进程。
+        :param text:
+        :param text_cursor_pos: (行，列)，行号从1开始
+        :param path:
+        :param type_budget: 求type的时间上限（秒），小于0时不限制
+        :param background: 是否为后台请求（比如预热），有交互请求等待时排在后面
+        :return:
+        """
+        records = self._call('complete', text, text_cursor_pos, path, type_budget, background)
+        return [Completion(*record) for record in records or ()]
+
+    def detail(self, text: str, text_cursor_pos: Tuple[int, int], path: str,
+               name: str) -> Tuple[str, str, Optional[str]]:
+        """
+        求补全位置上名为name的候选项的签名、文档和type
+        :return: (签名，文档，type)
+        """
+        return self._call('detail', text, text_cursor_pos, path, name) or ('', '', None)
+
+    def types(self, text: str, text_cursor_pos: Tuple[int, int], path: str,
+              keys: List[Tuple[str, Optional[str]]]) -> Dict[Tuple[str, Optional[str]], str]:
+        """
+        求补全位置上(name, full_name)在keys中的候选项的type
+        :return: {(name, full_name): type}
+        """
+        types = self._call('types', text, text_cursor_pos, path, keys, True) or ()
+        return {(name, full_name): type_ for name, full_name, type_ in types}
+
+    def _acquire(self, background: bool) -> CompletionWorker:
+        """
+        等待并取得一个空闲的工作进程。有交互请求在等待时，后台请求继续等待。
+        :param background:
+        :return:
+        """
+        with self._idle_condition:
+            if not background:
+                self._waiting += 1
+            try:
+                while not self._idle or (background and self._waiting):
+                    self._idle_condition.wait()
+                return self._idle.pop()
+            finally:
+                if not background:
+                    self._waiting -= 1
+                    self._idle_condition.notify_all()
+
+    def _release(self, worker: CompletionWorker):
+        with self._idle_condition:
+            self._idle.append(worker)
+            self._idle_condition.notify_all()
+
+    def _call(self, kind: str, text: str, text_cursor_pos: Tuple[int, int], path: str, arg,
+              background: bool = False):
+        """
+        在空闲的工作进程中处理请求。工作进程崩溃时返回None，并重新启动该进程。
+        """
+        worker = self._acquire(background)
+        thread_id = threading.get_ident()
+        with self._busy_lock:
+            self._busy[thread_id] = worker
+        try:
+            if not worker.is_alive():
+                self._restart(worker)
+            try:
+                result, rss = worker.call(kind, text, text_cursor_pos[0], text_cursor_pos[1], path, arg)
+            except (EOFError, OSError, ValueError):
+                logger.warning('completion worker died, restarting')
+                self._restart(worker)
+                return None
+            if worker.memory_limit_mb and rss > worker.memory_limit_mb * 1024:
+                logger.info('completion worker reached %d MB, restarting' % (rss // 1024))
+                self._restart(worker)
+            elif worker.memory_limit_mb and not rss:
+                if not self._rss_warned:
+                    self._rss_warned = True
+                    logger.warning('peak memory of completion workers is not available on this platform, '
+                                   'MEMORY_LIMIT_MB is disabled; restarting workers every %d requests instead'
+                                   % self.RESTART_AFTER_REQUESTS)
+                if worker.requests >= self.RESTART_AFTER_REQUESTS:
+                    self._restart(worker)
+            return result
+        finally:
+            with self._busy_lock:
+                del self._busy[thread_id]
+            self._release(worker)
+
+    def cancel(self, thread_id: int):
+        """
+        中止正在为线程thread_id处理的请求：结束处理该请求的工作进程，请求返回空结果，工作进程随即重新启动。
+        用于关闭编辑器时不必等待预热等耗时的请求完成。
+        :param thread_id: 发出请求的线程的threading.get_ident()
+        :return:
+        """
+        with self._busy_lock:
+            worker = self._busy.get(thread_id)
+            process = worker.process if worker is not None else None
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def _restart(self, worker: CompletionWorker):
+        worker.close()
+        worker.restarts += 1
+        worker.start()
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.close()
@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/12 9:30
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: fuzzy.py
+"""
+补全候选项的模糊匹配和排序。
+
+查询中的字符按顺序出现在名称中（不区分大小写）即为匹配，比如rdcsv匹配read_csv，df匹配DataFrame。
+从左向右逐个匹配查询中的字符：能紧接上一个匹配的字符时就紧接，否则优先匹配到单词边界（开头、_之后、
+驼峰的大写字母、字母后的数字）上，再否则匹配最左边的位置。这样匹配失败时，改为全部匹配最左边的位置。
+得分规则：每个匹配的字符得分；匹配在单词边界上或紧接上一个匹配的字符时加分；跳过的字符扣分；
+以查询为前缀的名称另外加分。得分相同时，不以_开头的、较短的名称排在前面。
+
+FuzzyIndex在创建时为每个候选项预先计算小写名称、单词边界和边界上的字符，并算好所有单字符查询的结果。
+上面的匹配过程每次只依赖上一个字符的匹配位置，所以查询在上一次查询的基础上追加字符时（正常输入时总是如此），
+只需在上一次的结果上再匹配一个字符。创建索引的时间约为一次查询的几十倍，应当在后台线程中创建（见AutoCompThread）。
+"""
+from typing import Callable, Dict, List, Sequence, Tuple
+
+SCORE_MATCH = 16  # 每个匹配的字符
+SCORE_BOUNDARY = 8  # 匹配在单词边界上
+SCORE_FIRST_CHAR = 8  # 匹配名称的第一个字符
+SCORE_CONSECUTIVE = 6  # 紧接上一个匹配的字符
+SCORE_PREFIX = 24  # 查询是名称的前缀（不区分大小写）
+PENALTY_GAP = 1  # 两个匹配之间每跳过一个字符
+PENALTY_LEADING = 2  # 第一个匹配之前每个字符，最多计MAX_LEADING个
+MAX_LEADING = 3
+
+
+def word_boundaries(name: str) -> Tuple[int, ...]:
+    """
+    名称中单词开始的位置：开头、_之后的字母或数字、小写字母或数字后的大写字母、字母后的数字
+    :param name:
+    :return:
+    """
+    if name.isalpha() and (name.islower() or name.isupper()):
+        return (0,)
+    boundaries = [0]
+    prev = name[:1]
+    for i in range(1, len(name)):
+        ch = name[i]
+        if (prev == '_' and ch != '_') or (ch.isupper() and (prev.islower() or prev.isdigit())) or \
+                (ch.isdigit() and prev.isalpha()):
+            boundaries.append(i)
+        prev = ch
+    return tuple(boundaries)
+
+
+# 匹配状态：(候选项序号, 是否优先匹配单词边界, 上一个字符匹配的位置, 不含前缀加分的得分,
+#           全部匹配最左边的位置时上一个字符的位置)
+State = Tuple[int, bool, int, int, int]
+
+
+class FuzzyIndex(object):
+    """
+    候选项列表的模糊匹配索引
+    """
+
+    def __init__(self, candidates: Sequence, key: Callable[[object], str] = lambda c: c.name):
+        """
+        :param candidates: 候选项，比如completionpool.Completion
+        :param key: 从候选项取得名称的函数
+        """
+        self.candidates = list(candidates)
+        self.names = [key(c) for c in self.candidates]
+        # 个别字符转换为小写后长度会改变，这样的名称只能区分大小写匹配
+        self.lowers = [lower if len(lower) == len(name) else name
+                       for lower, name in ((name.lower(), name) for name in self.names)]
+        self.boundaries = [word_boundaries(name) for name in self.names]
+        self.heads = [''.join([lower[b] for b in bounds]) for lower, bounds in zip(self.lowers, self.boundaries)]
+        # 得分相同时按照(是否以__开头，是否以_开头，长度，小写名称)排序，这里记下每个候选项在这个顺序中的名次
+        order = sorted(range(len(self.names)), key=lambda i: (self.names[i].startswith('__'),
+                                                              self.names[i].startswith('_'),
+                                                              len(self.names[i]), self.lowers[i]))
+        self.tie_ranks = [0] * len(order)
+        for rank, i in enumerate(order):
+            self.tie_ranks[i] = rank
+        # 小写查询 -> 排好序的匹配状态。只保留当前查询的各个前缀，退格时可以直接取出。
+        self._results: Dict[str, List[State]] = {'': [(i, True, -1, 0, -1) for i in order]}
+        # 单个字符的查询 -> 排好序的匹配状态。第一个字符的候选项最多，所以预先算好。
+        postings: Dict[str, List[State]] = {}
+        for i in order:
+            state = (i, True, -1, 0, -1)
+            for ch in set(self.lowers[i]):
+                postings.setdefault(ch, []).append(state)
+        self._first: Dict[str, List[State]] = {ch: self._extend(states, ch) for ch, states in postings.items()}
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def match(self, query: str) -> List:
+        """
+        返回与查询匹配的候选项，按得分从高到低排序
+        :param query: 为空时返回全部候选项
+        :return:
+        """
+        return [self.candidates[i] for i in self.match_indexes(query)]
+
+    def match_indexes(self, query: str) -> List[int]:
+        """
+        返回与查询匹配的候选项的序号，按得分从高到低排序
+        :param query:
+        :return:
+        """
+        lower_query = query.lower()
+        results = self._results
+        known = len(lower_query)
+        while lower_query[:known] not in results:
+            known -= 1
+        for stale in [q for q in results if q and not lower_query.startswith(q)]:
+            del results[stale]
+        for k in range(known, len(lower_query)):
+            if k == 0:
+                results[lower_query[0]] = self._first.get(lower_query[0], [])
+            else:
+                results[lower_query[:k + 1]] = self._extend(results[lower_query[:k]], lower_query[:k + 1])
+        indexes = [state[0] for state in results[lower_query]]
+        if query != lower_query:
+            # 查询中有大写字母时，大小写完全一致的前缀匹配排在前面
+            names = self.names
+            indexes.sort(key=lambda i: not names[i].startswith(query))
+        return indexes
+
+    def _extend(self, states: List[State], query: str) -> List[State]:
+        """
+        在查询query[:-1]的匹配状态上再匹配最后一个字符，并重新排序
+        :param states:
+        :param query: 小写查询
+        :return:
+        """
+        lowers, boundaries, heads, tie_ranks = self.lowers, self.boundaries, self.heads, self.tie_ranks
+        ch = query[-1]
+        first = len(query) == 1
+        scored = []
+        for i, prefer_boundary, prev, score, leftmost in states:
+            lower = lowers[i]
+            if prefer_boundary:
+                leftmost = lower.find(ch, leftmost + 1)
+                if leftmost < 0:
+                    continue
+            p = prev + 1
+            if not first and lower.startswith(ch, p):
+                score += SCORE_CONSECUTIVE + SCORE_MATCH
+            else:
+                p = lower.find(ch, p)
+                if p < 0:
+                    if prefer_boundary:
+                        # 优先匹配单词边界时跳过了需要的字符，改为全部匹配最左边的位置
+                        state = self._leftmost(i, query)
+                        scored.append((self._sort_key(state, query), state))
+                    continue
+                if p and prefer_boundary:
+                    j = heads[i].find(ch, 1)
+                    while j > 0 and boundaries[i][j] < p:
+                        j = heads[i].find(ch, j + 1)
+                    if j > 0:
+                        p = boundaries[i][j]
+                score += SCORE_MATCH - (PENALTY_LEADING * min(p, MAX_LEADING) if first else
+                                        PENALTY_GAP * (p - prev - 1))
+            if p == 0:
+                score += SCORE_FIRST_CHAR + SCORE_BOUNDARY
+            elif p in boundaries[i]:
+                score += SCORE_BOUNDARY
+            total = score + SCORE_PREFIX if lower.startswith(query) else score
+            # 排序键：得分高的在前，得分相同时按名次
+            scored.append(((-total << 20) | tie_ranks[i], (i, prefer_boundary, p, score, leftmost)))
+        scored.sort()
+        return [item[1] for item in scored]
+
+    def _sort_key(self, state: State, query: str) -> int:
+        i, score = state[0], state[3]
+        total = score + SCORE_PREFIX if self.lowers[i].startswith(query) else score
+        return (-total << 20) | self.tie_ranks[i]
+
+    def _leftmost(self, i: int, query: str) -> State:
+        """
+        把查询中的每个字符都匹配到最左边的位置。调用前已经确定候选项与查询匹配。
+        :param i:
+        :param query:
+        :return:
+        """
+        state = (i, False, -1, 0, -1)
+        for k in range(len(query)):
+            state = self._extend([state], query[:k + 1])[0]
+        return state
@@ -0,0 +1,199 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/11 9:40
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: jediworker.py
+"""
+补全工作进程。由completionpool.CompletionProcessPool以脚本方式启动，不导入qtpyeditor和Qt。
+
+通过标准输入输出收发消息，每条消息为4字节小端长度加上marshal编码的数据。请求有两种：
+('complete', text, row, col, path, type_budget)，回复(records, max_rss_kb)，records为(name, type, complete, full_name)
+元组构成的元组；('detail', text, row, col, path, name)，回复((signature, docstring, type), max_rss_kb)；
+('types', text, row, col, path, keys)，keys为(name, full_name)的列表，回复(((name, full_name, type), ...), max_rss_kb)。
+峰值内存超过命令行给出的上限时，回复之后自行退出，由进程池重新启动。
+"""
+import marshal
+import os
+import struct
+import sys
+import time
+
+HEADER = struct.Struct('<I')
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def read_message(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (size,) = HEADER.unpack(header)
+    return marshal.loads(stream.read(size))
+
+
+def write_message(stream, obj):
+    data = marshal.dumps(obj)
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def _windows_peak_rss_kb() -> int:
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    # Windows 7以后psapi的函数以K32前缀由kernel32导出
+    get_memory_info = kernel32.K32GetProcessMemoryInfo
+    get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    get_memory_info.restype = wintypes.BOOL
+    if not get_memory_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return 0
+    return counters.PeakWorkingSetSize // 1024
+
+
+def max_rss_kb() -> int:
+    """
+    本进程的峰值常驻内存（kB）。Unix上使用resource，Windows上使用psutil（如果已安装）或者GetProcessMemoryInfo。
+    :return: 无法取得时为0
+    """
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage // 1024 if sys.platform == 'darwin' else usage
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    try:
+        if psutil is not None:
+            info = psutil.Process().memory_info()
+            return getattr(info, 'peak_wset', info.rss) // 1024
+        if sys.platform == 'win32':
+            return _windows_peak_rss_kb()
+    except (OSError, AttributeError):
+        pass
+    return 0
+
+
+def completion_records(completions, type_budget: float = -1, should_stop=None) -> tuple:
+    """
+    把jedi的补全对象转换为(name, type, complete, full_name)元组。
+    jedi第一次求type时需要推断，冷启动时numpy的全部属性需要数秒，所以只在type_budget秒内求type，
+    超时后其余条目的type为None。jedi会缓存求得的type，预热之后这里几乎不花时间。
+    :param completions:
+    :param type_budget: 求type的时间上限（秒），小于0时不限制
+    :param should_stop: 每求一个type之前调用，返回True时其余条目的type为None，用于在线程中运行时中途退出
+    :return:
+    """
+    deadline = time.perf_counter() + type_budget if type_budget >= 0 else None
+    records = []
+    for c in completions:
+        if (deadline is not None and time.perf_counter() > deadline) or (should_stop is not None and should_stop()):
+            records.append((c.name, None, c.complete, c.full_name))
+        else:
+            records.append((c.name, c.type, c.complete, c.full_name))
+    return tuple(records)
+
+
+def completion_types(completions, keys, should_stop=None) -> tuple:
+    """
+    求(name, full_name)在keys中的补全对象的type，用于补上completion_records超时没有求出的type。
+    只对补全列表中可见的几行调用。
+    :param completions:
+    :param keys: (name, full_name)的序列
+    :param should_stop: 每求一个type之前调用，返回True时不再继续
+    :return: (name, full_name, type)元组构成的元组
+    """
+    keys = set(map(tuple, keys))
+    types = []
+    for c in completions:
+        if should_stop is not None and should_stop():
+            break
+        if (c.name, c.full_name) in keys:
+            types.append((c.name, c.full_name, c.type))
+    return tuple(types)
+
+
+def completion_detail(completions, name: str) -> tuple:
+    """
+    求名为name的补全对象的签名、文档和type。只对用户选中的一个候选项调用，求文档可能需要几百毫秒。
+    type在补全时可能因为超时没有求出（见completion_records），这里一并求出。
+    :param completions:
+    :param name:
+    :return: (签名，文档，type)，多个签名之间以换行分隔；找不到时为('', '', None)
+    """
+    for c in completions:
+        if c.name == name:
+            signature = '\n'.join(s.to_string() for s in c.get_signatures())
+            return signature, c.docstring(raw=True), c.type
+    return '', '', None
+
+
+def find_project(path: str, projects: dict, project_dirs: dict):
+    """
+    按setup.py、.git等标志查找文件所在的工程根目录，返回该根目录的jedi.Project，同一个根目录只创建一次
+    :param path: 文件路径，为空时返回None
+    :param projects: 工程根目录 -> jedi.Project，调用者持有
+    :param project_dirs: 文件所在目录 -> 工程根目录，调用者持有
+    :return:
+    """
+    if not path:
+        return None
+    import jedi
+    folder = os.path.dirname(os.path.abspath(path))
+    root = project_dirs.get(folder)
+    if root is None:
+        project = jedi.get_default_project(folder)
+        root = str(project.path)
+        project_dirs[folder] = root
+        projects.setdefault(root, project)
+    return projects[root]
+
+
+def main(memory_limit_mb: int, cache_directory: str):
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    sys.stdout = sys.stderr  # jedi或被分析的代码打印的内容不能混入回复
+    import jedi
+    if cache_directory:
+        jedi.settings.cache_directory = cache_directory
+    projects = {}  # 工程根目录 -> jedi.Project
+    project_dirs = {}  # 文件所在目录 -> 工程根目录
+    while True:
+        request = read_message(stdin)
+        if request is None:  # 主进程已经关闭管道
+            return
+        kind, text, row, col, path, arg = request
+        try:
+            project = find_project(path, projects, project_dirs)
+            completions = jedi.Script(text, path=path or None, project=project).complete(row, col)
+            if kind == 'detail':
+                result = completion_detail(completions, arg)
+            elif kind == 'types':
+                result = completion_types(completions, arg)
+            else:
+                result = completion_records(completions, arg)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            result = ('', '', None) if kind == 'detail' else ()
+        rss = max_rss_kb()
+        write_message(stdout, (result, rss))
+        if memory_limit_mb and rss > memory_limit_mb * 1024:
+            return
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else '')
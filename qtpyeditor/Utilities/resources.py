@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/13 10:20
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: resources.py
+"""
+进程范围内共享的图标、图片和翻译器缓存。
+
+每个编辑器都要用到同样的图标和翻译，以前每打开一个编辑器就重新解码一遍图片、加载并安装一个新的QTranslator。
+这里的缓存在第一次用到时才加载，之后所有编辑器共用同一个对象，所以打开第50个编辑器与打开第2个一样快。
+QIcon、QPixmap和QTranslator只能在界面线程中创建和使用，这些函数也只能在界面线程中调用。
+"""
+import logging
+import os
+from typing import Dict, Optional
+
+from qtpy.QtCore import QLocale, QTranslator
+from qtpy.QtGui import QIcon, QPixmap
+from qtpy.QtWidgets import QApplication
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ICON_FOLDER = os.path.join(PACKAGE_FOLDER, 'icons')
+TRANSLATION_FOLDER = os.path.join(PACKAGE_FOLDER, 'translations')
+
+_icons: Dict[str, QIcon] = {}
+_pixmaps: Dict[str, QPixmap] = {}
+_autocomp_icons: Optional[Dict[str, QIcon]] = None
+_translators: Dict[str, QTranslator] = {}
+
+
+def get_pixmap(name: str) -> QPixmap:
+    """
+    :param name: 相对于icons文件夹的路径，比如'autocomp/class.png'
+    :return:
+    """
+    pixmap = _pixmaps.get(name)
+    if pixmap is None:
+        pixmap = _pixmaps[name] = QPixmap(os.path.join(ICON_FOLDER, name))
+    return pixmap
+
+
+def get_icon(name: str) -> QIcon:
+    """
+    :param name: 相对于icons文件夹的路径，比如'save.svg'
+    :return:
+    """
+    icon = _icons.get(name)
+    if icon is None:
+        icon = _icons[name] = QIcon()
+        if name.endswith('.svg'):
+            icon.addFile(os.path.join(ICON_FOLDER, name))  # svg按显示的尺寸渲染
+        else:
+            icon.addPixmap(get_pixmap(name), QIcon.Normal, QIcon.Off)
+    return icon
+
+
+def get_autocomp_icons() -> Dict[str, QIcon]:
+    """
+    自动补全列表的图标，键为jedi的补全类型（module、class、function等），即icons/autocomp中的文件名
+    :return:
+    """
+    global _autocomp_icons
+    if _autocomp_icons is None:
+        icons = {}
+        for file_name in os.listdir(os.path.join(ICON_FOLDER, 'autocomp')):
+            icons[os.path.splitext(file_name)[0]] = get_icon('autocomp/' + file_name)
+        _autocomp_icons = icons
+    return _autocomp_icons
+
+
+def install_translator(name: str = 'qt', locale: str = '') -> QTranslator:
+    """
+    加载translations文件夹中的翻译并安装到QApplication上，同一个翻译只加载和安装一次
+    :param name: 翻译文件名的前缀，文件名为'<name>_<locale>.qm'
+    :param locale: 为空时使用系统的区域设置
+    :return:
+    """
+    file_name = '%s_%s.qm' % (name, locale or QLocale.system().name())
+    translator = _translators.get(file_name)
+    if translator is None:
+        translator = _translators[file_name] = QTranslator()
+        if translator.load(os.path.join(TRANSLATION_FOLDER, file_name)):
+            QApplication.instance().installTranslator(translator)
+        else:
+            logger.debug('translation file %s not found' % file_name)
+    return translator
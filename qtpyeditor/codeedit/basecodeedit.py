@@ -4,24 +4,24 @@
 # @Email: 1295752786@qq.com
 # @File: basecodeedit.py
 import logging
-import os
 import re
 import time
 from itertools import groupby
 from queue import Queue
 
-from PySide2.QtGui import QDropEvent, QPixmap
-
 from qtpy.QtWidgets import QAction
-from qtpy.QtCore import QRegExp, Qt, QModelIndex, Signal, QThread, QCoreApplication, QTimer, QUrl, QSize
+from qtpy.QtCore import QRegExp, Qt, QModelIndex, Signal, QThread, QCoreApplication, QTimer, QUrl, QSize, \
+    QAbstractListModel
 from qtpy.QtWidgets import QApplication, QFileDialog, QTextEdit, QTabWidget, \
     QMessageBox, QListWidget, QListWidgetItem, QWidget, QHBoxLayout, QVBoxLayout, QLabel, QPlainTextEdit, QShortcut, \
-    QTableWidget, QTableWidgetItem, QHeaderView
+    QTableView, QHeaderView, QAbstractItemView
 from qtpy.QtGui import QTextCursor, QKeyEvent, QMouseEvent, QIcon, QKeySequence, QFocusEvent, QColor, QTextFormat, \
-    QPainter, QTextDocument, QTextBlock
-from typing import List, Tuple, Dict, TYPE_CHECKING
+    QPainter, QTextDocument, QTextBlock, QDropEvent
+from typing import List, Tuple, Dict, Optional, Sequence, TYPE_CHECKING
 
 from qtpyeditor.highlighters.python import PythonHighlighter
+from qtpyeditor.Utilities.autocomp import CompletionCache, DetailCache, fill_types
+from qtpyeditor.Utilities.resources import get_autocomp_icons
 from qtpyeditor.syntaxana import getIndent
 
 from qtpyeditor.linenumber import QCodeEditor
@@ -30,38 +30,116 @@ from qtpyeditor.linenumber import QCodeEditor
 
 if TYPE_CHECKING:
     from jedi.api import Completion
+    from qtpyeditor.Utilities.autocomp import AutoCompThread
+    from qtpyeditor.Utilities.fuzzy import FuzzyIndex
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 logger.setLevel(logging.DEBUG)
 
 
-def create_icons():
-    icons = {}
-    icon_folder = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'icons', 'autocomp')
-    for icon_file_name in os.listdir(icon_folder):
-        icon_abso_path = os.path.join(icon_folder, icon_file_name)
-        icon1 = QIcon()  # create_icon(icon_abso_path)
-        icon1.addPixmap(QPixmap(icon_abso_path), QIcon.Normal, QIcon.Off)
-        # print(icon1)
-        logging.debug('loading {0}'.format(icon_file_name))
-        icons[icon_file_name[:-4]] = icon1
+def create_icons() -> Dict[str, QIcon]:
+    """
+    自动补全列表的图标。所有编辑器共用同一份，只在第一次调用时加载，见Utilities.resources
+    :return:
+    """
+    return get_autocomp_icons()
+
 
-    return icons
+class AutoCompModel(QAbstractListModel):
+    """
+    补全列表的数据模型，直接引用补全结果的序列，不为每个候选项创建条目。
+    视图只为滚动到可见区域的行调用data()和headerData()，所以名称、图标和0~9的快捷键标签都是在需要显示时才生成的，
+    显示5000个候选项和显示10个所用的时间相同。
+    """
+
+    def __init__(self, icons: Dict[str, QIcon], parent=None):
+        super().__init__(parent)
+        self.icons = icons
+        self.completions: Sequence['Completion'] = []
 
+    def set_completions(self, completions: Sequence['Completion']):
+        self.beginResetModel()
+        self.completions = completions
+        self.endResetModel()
 
-class AutoCompList(QTableWidget):
+    def fill_types(self, types: Dict[Tuple[str, Optional[str]], str]):
+        """
+        补上尚未求出的type，只刷新图标，不改变选中的行，见AutoCompThread.types_ready
+        :param types: {(name, full_name): type}
+        :return:
+        """
+        if not isinstance(self.completions, list):
+            self.completions = list(self.completions)
+        changed = fill_types(self.completions, types)
+        if changed:
+            self.dataChanged.emit(self.index(changed[0]), self.index(changed[-1]),
+                                  [Qt.DecorationRole, AutoCompList.ROLE_TYPE])
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.completions)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        completion = self.completions[index.row()]
+        if role == Qt.DisplayRole or role == AutoCompList.ROLE_NAME:
+            return completion.name
+        elif role == Qt.DecorationRole:
+            return self.icons.get(completion.type)
+        elif role == AutoCompList.ROLE_TYPE:
+            return completion.type
+        elif role == AutoCompList.ROLE_COMPLETE:
+            return completion.complete
+        return None
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Vertical:
+            return str(section) if section <= 9 else ''
+        return None
+
+
+class AutoCompList(QTableView):
     # {'module':}  # , class, instance, function, param, path, keyword, property and statement.'}
     ROLE_NAME = 15
     ROLE_TYPE = 16
     ROLE_COMPLETE = 17
-    ROLE_COMPLETION = 18
+
+    # 选中的行停留DETAIL_DELAY_MS毫秒后才请求该候选项的签名和文档，用方向键快速移动时不发出请求
+    DETAIL_DELAY_MS = 200
+    DETAIL_MAX_CHARS = 1200  # 详情面板中文档的最大字符数
+    signal_detail_requested = Signal(object)  # 选中的候选项
+    # 列表显示或者滚动之后TYPES_DELAY_MS毫秒，为可见的行中type为None的候选项请求type；列表关闭时发出空列表
+    TYPES_DELAY_MS = 100
+    signal_types_requested = Signal(object)  # type为None的候选项的列表
 
     def __init__(self, parent: 'PMBaseCodeEdit' = None):
         super().__init__(parent)
         self._parent: 'PMBaseCodeEdit' = parent
         self.last_show_time = 0
+        self.detail_widget = QLabel(parent)
+        self.detail_widget.setWordWrap(True)
+        self.detail_widget.setTextFormat(Qt.PlainText)
+        self.detail_widget.setMaximumWidth(400)
+        self.detail_widget.setStyleSheet('QLabel{background-color: #ffffe1; border: 1px solid #999999; padding: 2px;}')
+        self.detail_widget.hide()
+        self._detail_timer = QTimer(self)
+        self._detail_timer.setSingleShot(True)
+        self._detail_timer.timeout.connect(self._on_detail_timeout)
+        self._types_timer = QTimer(self)
+        self._types_timer.setSingleShot(True)
+        self._types_timer.setInterval(self.TYPES_DELAY_MS)
+        self._types_timer.timeout.connect(self._on_types_timeout)
+        self.verticalScrollBar().valueChanged.connect(self._types_timer.start)
         self.icons = create_icons()
+        self.completion_model = AutoCompModel(self.icons, self)
+        self.setModel(self.completion_model)
+        self.selectionModel().currentChanged.connect(self._on_current_changed)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # 行高固定，表头不必逐行计算尺寸
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.verticalHeader().setDefaultSectionSize(20)
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.horizontalHeader().hide()
@@ -70,7 +148,6 @@ class AutoCompList(QTableWidget):
         # self.horizontalHeader().setMinimumWidth(300)
         # self.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
 
-
     def verticalHeader(self) -> QHeaderView:
         return super(AutoCompList, self).verticalHeader()
 
@@ -78,6 +155,76 @@ class AutoCompList(QTableWidget):
         self.last_show_time = time.time()
         super().show()
 
+    def hideEvent(self, e) -> None:
+        self._detail_timer.stop()
+        self._types_timer.stop()
+        self.clear_detail()
+        self.signal_types_requested.emit([])
+        super().hideEvent(e)
+
+    def current_completion(self) -> Optional['Completion']:
+        row = self.currentRow()
+        return self.completion_model.completions[row] if 0 <= row < self.count() else None
+
+    def _on_current_changed(self, current: QModelIndex, previous: QModelIndex):
+        self.clear_detail()
+        self._detail_timer.start(self.DETAIL_DELAY_MS)
+
+    def _on_types_timeout(self):
+        if not self.isVisible() or self.count() == 0:
+            return
+        first = max(self.rowAt(0), 0)
+        last = self.rowAt(self.viewport().height() - 1)
+        if last < 0:
+            last = self.count() - 1
+        untyped = [c for c in self.completion_model.completions[first:last + 1] if c.type is None]
+        if untyped:
+            self.signal_types_requested.emit(untyped)
+
+    def _on_detail_timeout(self):
+        completion = self.current_completion()
+        if completion is not None and self.isVisible():
+            self.signal_detail_requested.emit(completion)
+
+    def show_detail(self, completion: 'Completion', signature: str, docstring: str):
+        """
+        在补全列表旁边显示候选项的签名和文档。结果到达时选中的已经不是该候选项，则不显示。
+        :param completion:
+        :param signature:
+        :param docstring:
+        :return:
+        """
+        current = self.current_completion()
+        # 求文档时可能顺便补上了type，选中的候选项已经被替换，所以按名称比较
+        if not self.isVisible() or current is None or \
+                (completion.name, completion.full_name) != (current.name, current.full_name):
+            return
+        docstring = docstring.strip()
+        if len(docstring) > self.DETAIL_MAX_CHARS:
+            docstring = docstring[:self.DETAIL_MAX_CHARS] + '...'
+        # 原始文档不含签名，签名显示在前面
+        text = '\n\n'.join(part for part in (signature, docstring) if part)
+        if not text:
+            self.clear_detail()
+            return
+        self.detail_widget.setText(text)
+        self.detail_widget.adjustSize()
+        geometry = self.geometry()
+        x = geometry.right() + 2
+        if self._parent is not None and x + self.detail_widget.width() > self._parent.width():
+            x = max(0, geometry.left() - self.detail_widget.width() - 2)
+        self.detail_widget.move(x, geometry.top())
+        self.detail_widget.show()
+        self.detail_widget.raise_()
+
+    def clear_detail(self):
+        """
+        清空并隐藏签名和文档，避免继续显示上一个候选项的内容
+        :return:
+        """
+        self.detail_widget.clear()
+        self.detail_widget.hide()
+
     def hide_autocomp(self):
         """
         隐藏自动补全菜单并且主界面设置焦点。
@@ -87,7 +234,13 @@ class AutoCompList(QTableWidget):
         self._parent.setFocus()
 
     def count(self):
-        return self.rowCount()
+        return self.completion_model.rowCount()
+
+    def currentRow(self) -> int:
+        return self.currentIndex().row()
+
+    def setCurrentRow(self, row: int):
+        self.setCurrentIndex(self.completion_model.index(row, 0))
 
     def keyPressEvent(self, e: QKeyEvent) -> None:
         if self.isVisible():
@@ -114,7 +267,7 @@ class AutoCompList(QTableWidget):
                         e.modifiers() == Qt.ControlModifier or e.modifiers() == Qt.AltModifier):
                     index = e.key() - Qt.Key_0
                     if 0 <= index < self.count():
-                        self.setCurrentItem(self.item(index, 0))
+                        self.setCurrentRow(index)
                         self._parent._insert_autocomp()
                         self._parent.setFocus()
                         self.hide()
@@ -126,47 +279,27 @@ class AutoCompList(QTableWidget):
         super().keyPressEvent(e)
         e.ignore()
 
-    def set_completions(self, completions: List['Completion']):
+    def set_completions(self, completions: Sequence['Completion']):
         """
         module, class, instance, function, param, path, keyword, property and statement.
         :param completions:
         :return:
         """
         t0 = time.time()
-        self.setRowCount(0)
-        self.items_list = []
-        self.setRowCount(len(completions))
-        self.setColumnCount(1)
-        labels = []
-        for i, completion in enumerate(completions):
-            item = QTableWidgetItem(completion.name)
-            item.setData(AutoCompList.ROLE_NAME, completion.name)
-
-            item.setData(AutoCompList.ROLE_COMPLETION, completion)
-            item.setText(completion.name)
-            if i < 30:  # 当条目数太多的时候，不能添加图标，否则速度会非常慢
-                icon = self.icons.get(completion.type)
-                if icon is not None:
-                    item.setIcon(icon)
-
-            self.setItem(i, 0, item)
-            if 0 <= i <= 9:
-                labels.append(str(i))
-            else:
-                labels.append('')
-        self.setVerticalHeaderLabels(labels)
+        self.completion_model.set_completions(completions)
         self.show()
         self.setFocus()
-        self.setCurrentItem(self.item(0, 0))
+        self.setCurrentRow(0)
+        self._types_timer.start()
         t1 = time.time()
         logger.info('completion time:{0},completion list length:{1}'.format(t1 - t0, len(completions)))
 
     def get_complete(self, row: int) -> Tuple[str, str]:
-        return self.item(row, 0).data(AutoCompList.ROLE_COMPLETION).complete, self.item(row, 0).data(
-            AutoCompList.ROLE_COMPLETION).type
+        completion = self.completion_model.completions[row]
+        return completion.complete, completion.type
 
     def get_text(self, row: int) -> str:
-        return self.item(row, 0).text()
+        return self.completion_model.completions[row].name
 
 
 class PMBaseCodeEdit(QCodeEditor):
@@ -177,7 +310,18 @@ class PMBaseCodeEdit(QCodeEditor):
     signal_idle = Signal()
     signal_text_modified = Signal()  # If status changed from unmodified to modified, this signal emits.
     signal_file_dropped = Signal(str)
+    signal_large_file_mode_changed = Signal(int)
     UPDATE_CODE_HIGHLIGHT = 1
+    HIGHLIGHT_PREFETCH_BLOCKS = 50  # 懒惰着色时，可见区域上下额外立即着色的块数
+
+    # 大文件模式。进入后关闭自动补全和悬停提示，也不再为判断是否修改而复制整篇文本。
+    LARGE_FILE_OFF = 0  # 正常模式
+    LARGE_FILE_CHEAP = 1  # 后台线程着色，超长的行按普通文本显示
+    LARGE_FILE_PLAIN = 2  # 不做语法高亮
+    LARGE_FILE_CHARS = 2 * 1024 * 1024  # 字符数达到此值时使用LARGE_FILE_CHEAP
+    HUGE_FILE_CHARS = 20 * 1024 * 1024  # 字符数达到此值时使用LARGE_FILE_PLAIN
+    LONG_LINE_CHARS = 10000  # 存在长度达到此值的行时使用LARGE_FILE_CHEAP，这些行不做词法分析
+    HUGE_LINE_CHARS = 1000000  # 存在长度达到此值的行时使用LARGE_FILE_PLAIN
 
     def __init__(self, parent=None):
         super(PMBaseCodeEdit, self).__init__(parent)
@@ -189,15 +333,26 @@ class PMBaseCodeEdit(QCodeEditor):
         self.filename = '*'
         self.path = ''
         self.modified = False
-        self._last_text = ''
+        self._last_text: Optional[str] = ''
         self.highlighter: 'PythonHighlighter' = None
+        self.large_file_mode = self.LARGE_FILE_OFF
         self.text_modified_signal_allowed = True
         self.setTabChangesFocus(False)
 
+        # 语法高亮修改格式时也会发出textChanged信号，只有contentsChange信号才意味着文字真正发生了改变。
+        self._contents_changed = False
+        self.completion_cache = CompletionCache()
+        self.autocomp_thread: 'AutoCompThread' = None  # 由子类创建
+        self._completion_text_length = -1  # 补全线程中文档副本的长度，-1表示需要重新同步全文
+        self.document().contentsChange.connect(self._on_contents_change)
         self.textChanged.connect(self.on_text_changed)
+        self.verticalScrollBar().valueChanged.connect(self._update_highlight_viewport)
 
         self.popup_hint_widget = AutoCompList(self)
         self.popup_hint_widget.doubleClicked.connect(self._insert_autocomp)
+        self.popup_hint_widget.signal_detail_requested.connect(self._request_detail)
+        self.popup_hint_widget.signal_types_requested.connect(self._request_types)
+        self.detail_cache = DetailCache()
         self.popup_hint_widget.hide()
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.ui_update_timer = QTimer()
@@ -205,7 +360,50 @@ class PMBaseCodeEdit(QCodeEditor):
 
         self.ui_update_timer.timeout.connect(self.update_ui)
 
-        self.textChanged.connect(self.update_last_operation_time)
+    def _on_contents_change(self, position: int, chars_removed: int, chars_added: int):
+        if chars_removed or chars_added:
+            self._contents_changed = True
+            self.completion_cache.on_contents_change(position)
+            if self.autocomp_thread is not None:
+                self._sync_completion_text(position, chars_removed, chars_added)
+            self.update_last_operation_time()
+
+    def _sync_completion_text(self, position: int, chars_removed: int, chars_added: int):
+        """
+        把文档的修改同步到补全线程中的文档副本，只传递插入的文本，代价与文件大小无关。
+        修改前后的长度对不上时（比如setPlainText整篇替换，或者文本中有UTF-16代理对，位置无法对应），
+        副本标记为失效，下一次请求补全时再传递全文。
+        :param position:
+        :param chars_removed:
+        :param chars_added:
+        :return:
+        """
+        if self._completion_text_length < 0 or self.large_file_mode != self.LARGE_FILE_OFF:
+            self._completion_text_length = -1
+            return
+        document = self.document()
+        length = document.characterCount() - 1
+        if self._completion_text_length == length + chars_removed - chars_added and position + chars_added <= length:
+            cursor = QTextCursor(document)
+            cursor.setPosition(position)
+            cursor.setPosition(position + chars_added, QTextCursor.KeepAnchor)
+            # 与toPlainText()的转换保持一致
+            text_added = cursor.selectedText().replace('\u2029', '\n').replace('\u2028', '\n').replace('\xa0', ' ')
+            if len(text_added) == chars_added:
+                self.autocomp_thread.apply_change(position, chars_removed, text_added)
+                self._completion_text_length = length
+                return
+        self._completion_text_length = -1
+
+    def _reset_completion_text(self):
+        """
+        把全文传给补全线程。文本中有UTF-16代理对时，副本的位置无法与文档对应，保持失效状态，每次请求都传递全文。
+        :return:
+        """
+        text = self.toPlainText()
+        self.autocomp_thread.reset_text(text)
+        length = self.document().characterCount() - 1
+        self._completion_text_length = length if len(text) == length else -1
 
     def update_last_operation_time(self):
         """
@@ -224,28 +422,101 @@ class PMBaseCodeEdit(QCodeEditor):
                 if action == self.UPDATE_CODE_HIGHLIGHT:
                     self.text_modified_signal_allowed = False
                     focus_widget: QWidget = QApplication.focusWidget()
-                    self.highlighter.rehighlight()
+                    self.highlighter.rehighlight_dirty()
                     self.text_modified_signal_allowed = True
                     if focus_widget is not None:
                         focus_widget.setFocus()
 
-    def on_autocomp_signal_received(self, text_cursor_pos: tuple, completions: List['jedi.api.classes.Completion']):
+    def on_autocomp_signal_received(self, text_cursor_pos: tuple, index: 'FuzzyIndex'):
         '''
         当收到自动补全提示信号时，执行的函数。
-        :param text_cursor_pos:
-        :param completions:
+        :param text_cursor_pos:(row,col,hint_when_completion_triggered,revision)
+        :param index: 全部候选项的模糊匹配索引，见AutoCompThread
         :return:
         '''
+        if text_cursor_pos[3] != self.document().revision():  # 文档已经改变，结果已经过时
+            return
         current_cursor_pos = self._get_textcursor_pos()
-        if current_cursor_pos[0] + 1 == text_cursor_pos[0] and current_cursor_pos[1] == text_cursor_pos[1]:
-            if len(completions) == 1:
-                if completions[0].name == self._get_hint():
-                    self.hide_autocomp()
-                    return
+        if current_cursor_pos[0] + 1 != text_cursor_pos[0] or current_cursor_pos[1] != text_cursor_pos[1]:
+            self.hide_autocomp()
+            return
+        hint = self._get_hint()
+        if hint == '' or hint.isidentifier():
+            # 候选项是标识符开头处的全部名称，保存起来，之后在同一个标识符中输入时直接从中匹配
+            self.completion_cache.store(self.textCursor().position() - len(hint), hint, index)
+            self._complete_from_cache(hint)
+            return
+        completions = index.candidates
+        if len(completions) == 1 and completions[0].name == hint:
+            self.hide_autocomp()
+            return
+        self.autocomp_show(completions)
 
-            self.autocomp_show(completions)
-        else:
+    def _complete_from_cache(self, hint: str) -> bool:
+        """
+        光标仍在上次补全的标识符中时，由缓存的候选列表给出补全结果
+        :param hint:
+        :return: 是否命中缓存
+        """
+        completions = self.completion_cache.lookup(self.textCursor().position() - len(hint), hint)
+        if completions is None:
+            return False
+        if not completions or (len(completions) == 1 and completions[0].name == hint):
             self.hide_autocomp()
+        else:
+            self.autocomp_show(completions)
+        return True
+
+    def _request_detail(self, completion: 'Completion'):
+        """
+        补全列表中选中的行停留一段时间后调用。有缓存时直接显示，否则交给补全线程在后台求签名和文档。
+        :param completion:
+        :return:
+        """
+        detail = self.detail_cache.get(completion)
+        if detail is not None:
+            self.popup_hint_widget.show_detail(completion, *detail)
+            return
+        if self.autocomp_thread is None or self._completion_text_length < 0:
+            # 无法求签名和文档（比如光标已经离开补全位置），不能留着上一个候选项的内容
+            self.popup_hint_widget.clear_detail()
+            return
+        row, col = self._get_textcursor_pos()
+        self.autocomp_thread.request_detail((row + 1, col), self.path, self._get_hint(), completion)
+
+    def _request_types(self, completions: List['Completion']):
+        """
+        补全列表中可见的行有type为None的候选项时调用，交给补全线程补求type；列表关闭时completions为空，取消请求
+        :param completions:
+        :return:
+        """
+        if self.autocomp_thread is None:
+            return
+        if not completions or self._completion_text_length < 0:
+            self.autocomp_thread.cancel_types()
+            return
+        row, col = self._get_textcursor_pos()
+        self.autocomp_thread.request_types((row + 1, col), self.path, self._get_hint(), completions)
+
+    def on_types_received(self, types: Dict[Tuple[str, Optional[str]], str]):
+        """
+        补全线程求出了之前超时的type后调用，补上缓存的候选项和补全列表中的type
+        :param types: {(name, full_name): type}
+        :return:
+        """
+        self.completion_cache.fill_types(types)
+        self.popup_hint_widget.completion_model.fill_types(types)
+
+    def on_detail_received(self, completion: 'Completion', signature: str, docstring: str):
+        """
+        补全线程求出候选项的签名和文档后调用
+        :param completion:
+        :param signature:
+        :param docstring:
+        :return:
+        """
+        self.detail_cache.put(completion, signature, docstring)
+        self.popup_hint_widget.show_detail(completion, signature, docstring)
 
     def hide_autocomp(self):
         self.popup_hint_widget.hide_autocomp()
@@ -255,16 +526,26 @@ class PMBaseCodeEdit(QCodeEditor):
         文字发生改变时的方法
         :return:
         """
-        if self.modified == True:
-            pass
-        else:
-            if self.toPlainText() != self._last_text:
+        if not self._contents_changed:  # 仅仅是格式发生了变化，比如后台语法高亮
+            return
+        self._contents_changed = False
+        if self.large_file_mode != self.LARGE_FILE_OFF:
+            # 大文件模式下不保存整篇文本的副本，任何内容变化都视为修改。
+            if not self.modified:
                 self.modified = True
                 if self.text_modified_signal_allowed:
                     self.signal_text_modified.emit()
-            else:
-                pass
-        self._last_text = self.toPlainText()
+            return
+        if self.modified == True:
+            # 已经修改过，不必每次按键都复制全文。保存之后的第一次内容变化直接视为修改。
+            self._last_text = None
+            return
+        text = self.toPlainText()
+        if text != self._last_text:
+            self.modified = True
+            if self.text_modified_signal_allowed:
+                self.signal_text_modified.emit()
+        self._last_text = text
 
     def _insert_autocomp(self, e: QModelIndex = None):
         raise NotImplementedError
@@ -285,6 +566,8 @@ class PMBaseCodeEdit(QCodeEditor):
         return hint
 
     def _request_autocomp(self):
+        if self.large_file_mode != self.LARGE_FILE_OFF:
+            return
         pos = self._get_textcursor_pos()
         nearby_text = self._get_nearby_text()
         hint = self._get_hint()
@@ -292,8 +575,12 @@ class PMBaseCodeEdit(QCodeEditor):
         if hint == '' and not nearby_text.endswith(('.', '\\\\', '/')):
             self.popup_hint_widget.hide_autocomp()
             return
-        self.autocomp_thread.text_cursor_pos = (pos[0] + 1, pos[1])
-        self.autocomp_thread.text = self.toPlainText()
+        if self._complete_from_cache(hint):
+            return
+        if self._completion_text_length < 0:
+            self._reset_completion_text()
+        revision = self.document().revision()
+        self.autocomp_thread.request(revision, (pos[0] + 1, pos[1]), self.path, hint)
 
     def autocomp_show(self, completions: list):
         raise NotImplementedError
@@ -389,7 +676,7 @@ class PMBaseCodeEdit(QCodeEditor):
         text = cursor.block().text()
         text, indent = getIndent(text)
 
-        if text.endswith(':'):
+        if text.endswith(':') or self._opens_bracket(cursor.blockNumber()):
 
             cursor.insertText('\n' + ' ' * (indent + 4))
         else:
@@ -397,6 +684,17 @@ class PMBaseCodeEdit(QCodeEditor):
             cursor.insertText('\n' + ' ' * indent)
         cursor.endEditBlock()
 
+    def _opens_bracket(self, block_number: int) -> bool:
+        """
+        根据这一行的括号增减数判断是否新开了未闭合的括号，区段从高亮器的缓存中取得，不需要重新做词法分析。
+        :param block_number:
+        :return:
+        """
+        if self.highlighter is None:
+            return False
+        delta = self.highlighter.block_bracket_delta(block_number)
+        return delta is not None and delta > 0
+
     def comment(self):
         cursor = self.textCursor()
         cursor.beginEditBlock()
@@ -619,7 +917,18 @@ class PMBaseCodeEdit(QCodeEditor):
         # self.textEdit.setEolMode(QsciScintilla.EolUnix)  # \n换行
 
     def load_color_scheme(self, scheme: Dict[str, str]):
-        PythonHighlighter.font_cfg.load_color_scheme(scheme)
+        PythonHighlighter.load_color_scheme(scheme)
+        if self.highlighter is not None:
+            self.highlighter.reload_formats()
+
+    def set_color_scheme(self, scheme: str):
+        """
+        切换到已注册的配色方案（'default'、'light'、'dark'等），只重绘，不重新做词法分析。
+        :param scheme:
+        :return:
+        """
+        if self.highlighter is not None:
+            self.highlighter.set_color_scheme(scheme)
 
     def getCursorPosition(self) -> int:
         # QTextCursor.position()
@@ -692,16 +1001,134 @@ class PMBaseCodeEdit(QCodeEditor):
         """
         self.highlighter.registerHighlight(line, start, length, marker, hint)
 
+    def register_highlights(self, lines: Sequence[int], starts: Sequence[int], lengths: Sequence[int],
+                            markers: Sequence[int], hint_indexes: Sequence[int], hints: List[str],
+                            source: str = None, replace: bool = False):
+        """
+        批量注册高亮，比如一次代码检查的全部结果，注册后立即重新着色受影响的行。
+        :param lines: 各标记的行号，可以是list、array.array或NumPy数组，下同
+        :param starts: 各标记的起始列
+        :param lengths: 各标记的长度，为-1时表示一直到行尾
+        :param markers: 各标记使用的标记颜色等
+        :param hint_indexes: 各标记的提示文字在hints中的下标
+        :param hints: 提示文字
+        :param source: 标记的来源，比如代码检查工具的名称
+        :param replace: 为True时整体替换该来源上一次注册的标记
+        :return:
+        """
+        self.highlighter.register_highlights(lines, starts, lengths, markers, hint_indexes, hints, source, replace)
+
     def clear_highlight(self):
         """
         清除高亮
         :return:
         """
-        self.highlighter.highlight_marks = {}
+        self.highlighter.clearHighlight()
 
     def rehighlight(self):
+        """
+        请求在空闲时对标记发生变化的行重新着色
+        :return:
+        """
         self.update_request_queue.put(self.UPDATE_CODE_HIGHLIGHT)
 
+    def set_lazy_highlight(self, lazy: bool):
+        """
+        设置懒惰着色模式。打开后，只有可见区域及上下各HIGHLIGHT_PREFETCH_BLOCKS块会立即着色，
+        其余的块在事件循环中分片着色，打开大文件时无需等待整篇文档着色完毕。
+        :param lazy:
+        :return:
+        """
+        self.highlighter.set_lazy(lazy)
+        self._update_highlight_viewport()
+
+    def set_threaded_highlight(self, threaded: bool):
+        """
+        设置后台线程着色模式。打开后，可见区域以外的块在后台线程中进行词法分析，GUI线程只分批设置格式，
+        适合打开大文件时使用。打开时会同时打开懒惰着色模式。
+        :param threaded:
+        :return:
+        """
+        self.highlighter.set_threaded(threaded)
+        self._update_highlight_viewport()
+
+    @classmethod
+    def detect_large_file_mode(cls, text: str) -> int:
+        """
+        根据文本的大小和最长行的长度选择大文件模式
+        :param text:
+        :return: LARGE_FILE_OFF、LARGE_FILE_CHEAP或LARGE_FILE_PLAIN
+        """
+        size = len(text)
+        if size >= cls.HUGE_FILE_CHARS:
+            return cls.LARGE_FILE_PLAIN
+        if cls._has_long_line(text, cls.HUGE_LINE_CHARS):
+            return cls.LARGE_FILE_PLAIN
+        if size >= cls.LARGE_FILE_CHARS or cls._has_long_line(text, cls.LONG_LINE_CHARS):
+            return cls.LARGE_FILE_CHEAP
+        return cls.LARGE_FILE_OFF
+
+    @staticmethod
+    def _has_long_line(text: str, length: int) -> bool:
+        """
+        判断是否存在长度达到length的行。在[start, start + length)内用rfind查找最后一个换行符，
+        找不到说明从start开始的这一行足够长，否则从该换行符之后继续，查找次数约为len(text) / length，
+        不拆分文本，也不为每一行创建字符串
+        :param text:
+        :param length:
+        :return:
+        """
+        start = 0
+        size = len(text)
+        while size - start >= length:
+            newline = text.rfind('\n', start, start + length)
+            if newline < 0:
+                return True
+            start = newline + 1
+        return False
+
+    def set_large_file_mode(self, mode: int):
+        """
+        设置大文件模式，可以随时切换回正常模式。
+        LARGE_FILE_PLAIN会把语法高亮器从文档上取下，加载文本时完全不调用highlightBlock。
+        :param mode: LARGE_FILE_OFF、LARGE_FILE_CHEAP或LARGE_FILE_PLAIN
+        :return:
+        """
+        if mode == self.large_file_mode:
+            return
+        self.large_file_mode = mode
+        self.hide_autocomp()
+        highlighter = self.highlighter
+        if highlighter is not None:
+            if mode == self.LARGE_FILE_PLAIN:
+                highlighter.set_threaded(False)
+                highlighter.setDocument(None)
+            else:
+                if highlighter.document() is None:
+                    highlighter.setDocument(self.document())
+                highlighter.set_max_line_length(self.LONG_LINE_CHARS if mode == self.LARGE_FILE_CHEAP else -1)
+                self.set_threaded_highlight(mode == self.LARGE_FILE_CHEAP)
+                highlighter.rehighlight()
+        if mode == self.LARGE_FILE_OFF and not self.modified:
+            self._last_text = self.toPlainText()
+        self.signal_large_file_mode_changed.emit(mode)
+
+    def _update_highlight_viewport(self):
+        """
+        将可见区域的块号范围告知语法高亮器
+        :return:
+        """
+        if self.highlighter is None:
+            return
+        first = self.firstVisibleBlock().blockNumber()
+        visible_count = self.viewport().height() // max(self.fontMetrics().height(), 1) + 1
+        self.highlighter.set_visible_range(first - self.HIGHLIGHT_PREFETCH_BLOCKS,
+                                           first + visible_count + self.HIGHLIGHT_PREFETCH_BLOCKS)
+
+    def resizeEvent(self, event):
+        super(PMBaseCodeEdit, self).resizeEvent(event)
+        self._update_highlight_viewport()
+
     def textCursor(self) -> QTextCursor:
         return super(PMBaseCodeEdit, self).textCursor()
 
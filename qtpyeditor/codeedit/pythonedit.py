@@ -6,11 +6,11 @@
 import logging
 import time
 import re
-from typing import Tuple, List, TYPE_CHECKING
+from typing import Dict, Optional, Tuple, List, TYPE_CHECKING
 
 from qtpy.QtGui import QTextCursor, QMouseEvent, QKeyEvent, QTextBlock
 from qtpy.QtWidgets import QLabel, QListWidgetItem, QApplication
-from qtpy.QtCore import QPoint, QModelIndex, Signal
+from qtpy.QtCore import QPoint, QModelIndex, Signal, QThread
 
 from qtpyeditor.codeedit import PMBaseCodeEdit
 from qtpyeditor.highlighters import PythonHighlighter
@@ -31,10 +31,15 @@ class PMPythonCodeEdit(PMBaseCodeEdit):
         # self.path = ''
         # self.modified = True
         self.highlighter = PythonHighlighter(self.document())
+        self.set_lazy_highlight(True)
         self.setTabChangesFocus(False)
         self.autocomp_thread = AutoCompThread()
         self.autocomp_thread.trigger.connect(self.on_autocomp_signal_received)
-        self.autocomp_thread.start()
+        self.autocomp_thread.detail_ready.connect(self.on_detail_received)
+        self.autocomp_thread.types_ready.connect(self.on_types_received)
+        # 补全线程的优先级最低，不与界面线程争抢CPU
+        self.autocomp_thread.start(QThread.LowestPriority)
+        self.autocomp_thread.warm_up()
 
         self.setMouseTracking(True)
         self.last_mouse_position: QPoint = None
@@ -42,30 +47,26 @@ class PMPythonCodeEdit(PMBaseCodeEdit):
 
         self.hint_widget = QLabel('', parent=self)
         self.hint_widget.setVisible(False)
-
-    def on_autocomp_signal_received(self, text_cursor_content: tuple, completions: List['jedi.api.Completion']):
-        '''
-        当收到自动补全提示信号时，执行的函数。
-        :param text_cursor_content:(row,col,hint_when_completion_triggered)
-        :param completions:
-        :return:
-        '''
-
-        hint = self._get_hint()
-        logger.debug('hint_when_completion_triggered:{0},current_hint:{1}'.format(text_cursor_content[2], hint))
-        if hint.startswith(text_cursor_content[2]):
-            if len(completions) == 1:
-                if completions[0].name == self._get_hint():
-                    self.hide_autocomp()
-                    return
-            self.autocomp_show(completions)
-        else:
-            self.hide_autocomp()
+        # 插入时type尚未求出的候选项：((name, full_name), 插入后的光标位置, 插入后的文档修订号)
+        self._untyped_insertion: Optional[Tuple[Tuple[str, Optional[str]], int, int]] = None
 
     def hide_autocomp(self):
         self.popup_hint_widget.hide_autocomp()
 
+    def warm_up_completion(self):
+        """
+        在后台预热当前文件导入的模块，一般在打开文件之后调用
+        :return:
+        """
+        if self.large_file_mode != self.LARGE_FILE_OFF or not self.autocomp_thread.runs_background_jobs():
+            return
+        if self._completion_text_length < 0:
+            self._reset_completion_text()
+        self.autocomp_thread.warm_up(path=self.path)
+
     def on_text_changed(self):
+        if not self._contents_changed:
+            return
         super(PMPythonCodeEdit, self).on_text_changed()
         self._get_textcursor_pos()
         cursor_pos = self.cursorRect()
@@ -80,21 +81,63 @@ class PMPythonCodeEdit(PMBaseCodeEdit):
         if 0 <= row < self.popup_hint_widget.count():
             complete, word_type = self.popup_hint_widget.get_complete(row)
             word = self.popup_hint_widget.get_text(row)
-            if not word.startswith(self._get_hint()):
-                return
-            comp = word[len(self._get_hint()):]
-            self.insertPlainText(comp)
-            textcursor: QTextCursor = self.textCursor()
-            word = self.get_word(textcursor.blockNumber(), textcursor.columnNumber() - 1)
-            if word_type == 'function':
-                self.insertPlainText('()')
+            completion = self.popup_hint_widget.current_completion()
+            hint = self._get_hint()
+            if hint.isidentifier():
+                # 模糊匹配的候选项不一定以hint开头，用候选项替换整个hint
                 tc = self.textCursor()
-                tc.movePosition(QTextCursor.PreviousCharacter)
+                tc.movePosition(QTextCursor.PreviousCharacter, QTextCursor.KeepAnchor, len(hint))
+                tc.insertText(word)
                 self.setTextCursor(tc)
-            elif word_type == 'keyword':
-                self.insertPlainText(' ')
+            else:
+                if not word.startswith(hint):
+                    return
+                self.insertPlainText(word[len(hint):])
+            textcursor: QTextCursor = self.textCursor()
+            word = self.get_word(textcursor.blockNumber(), textcursor.columnNumber() - 1)
+            if word_type is None:
+                self._resolve_inserted_type(completion)
+            else:
+                self._insert_type_suffix(word_type)
             self.popup_hint_widget.hide()
 
+    def _insert_type_suffix(self, word_type: str):
+        """
+        插入候选项之后，函数补上括号并把光标放在括号中，关键字补上空格
+        :param word_type:
+        :return:
+        """
+        if word_type == 'function':
+            self.insertPlainText('()')
+            tc = self.textCursor()
+            tc.movePosition(QTextCursor.PreviousCharacter)
+            self.setTextCursor(tc)
+        elif word_type == 'keyword':
+            self.insertPlainText(' ')
+
+    def _resolve_inserted_type(self, completion: 'Completion'):
+        """
+        插入的候选项的type在补全时超时没有求出。请补全线程求出type，
+        结果到达时（见on_types_received）如果光标仍在插入之后的位置、其间没有修改，再补上括号或空格。
+        :param completion:
+        :return:
+        """
+        if self._completion_text_length < 0:
+            self._reset_completion_text()
+        self._untyped_insertion = ((completion.name, completion.full_name), self.textCursor().position(),
+                                   self.document().revision())
+        row, col = self._get_textcursor_pos()
+        self.autocomp_thread.request_detail((row + 1, col), self.path, self._get_hint(), completion)
+
+    def on_types_received(self, types: Dict[Tuple[str, Optional[str]], str]):
+        super(PMPythonCodeEdit, self).on_types_received(types)
+        pending = self._untyped_insertion
+        if pending is None or pending[0] not in types:
+            return
+        self._untyped_insertion = None
+        if self.textCursor().position() == pending[1] and self.document().revision() == pending[2]:
+            self._insert_type_suffix(types[pending[0]])
+
     def _get_nearby_text(self):
         block_text = self.textCursor().block().text()
         col = self.textCursor().columnNumber()
@@ -111,6 +154,8 @@ class PMPythonCodeEdit(PMBaseCodeEdit):
         return hint
 
     def _request_autocomp(self):
+        if self.large_file_mode != self.LARGE_FILE_OFF:
+            return
         pos = self._get_textcursor_pos()
         nearby_text = self._get_nearby_text()
         hint = self._get_hint()
@@ -118,8 +163,12 @@ class PMPythonCodeEdit(PMBaseCodeEdit):
         if hint == '' and not nearby_text.endswith(('.', '\\\\', '/')):
             self.popup_hint_widget.hide_autocomp()
             return
-        self.autocomp_thread.text_cursor_pos = (pos[0] + 1, pos[1])
-        self.autocomp_thread.text = self.toPlainText()
+        if self._complete_from_cache(hint):
+            return
+        if self._completion_text_length < 0:
+            self._reset_completion_text()
+        revision = self.document().revision()
+        self.autocomp_thread.request(revision, (pos[0] + 1, pos[1]), self.path, hint)
 
     def autocomp_show(self, completions: List['Completion']):
         l = []
@@ -186,18 +235,12 @@ class PMPythonCodeEdit(PMBaseCodeEdit):
         line, col = cursor.blockNumber(), cursor.positionInBlock()
         flag = False
         text = ''
-        if line in self.highlighter.highlight_marks:
-            marker_propertys = self.highlighter.highlight_marks.get(line)
-            for marker_property in marker_propertys:
-                start = marker_property[0]
-                if marker_property[1] == -1:
-                    end = len(cursor.block().text())
-                else:
-                    end = start + marker_property[1]
-                if start <= col < end:
-                    flag = True
-                    text += marker_property[3] + '\n'
-                    break
+        block_marks = self.highlighter.highlight_marks.get(line)
+        if block_marks is not None:
+            segment = block_marks.find(col, cursor.block().length() - 1)
+            if segment is not None:
+                flag = True
+                text = '\n'.join(segment.hints)
 
         self.hint_widget.setGeometry(e.x() + 30, e.y(),
                                      self.hint_widget.sizeHint().width(), self.hint_widget.sizeHint().height())
@@ -210,7 +253,7 @@ class PMPythonCodeEdit(PMBaseCodeEdit):
         返回是否会对代码做insight.
         :return:
         """
-        return len(self.toPlainText()) < 10000 * 120
+        return self.large_file_mode == self.LARGE_FILE_OFF and self.document().characterCount() < 10000 * 120
 
 
 if __name__ == '__main__':
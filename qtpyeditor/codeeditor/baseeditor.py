@@ -41,8 +41,8 @@ import re
 import time
 from itertools import groupby
 from typing import TYPE_CHECKING, List, Iterable, Dict, Set, Tuple, Any
-from qtpy.QtGui import QIcon, QKeySequence, QTextDocument, QTextCursor, QTextBlock, QDropEvent
-from qtpy.QtCore import QDir, QCoreApplication, Qt, QPoint, Signal, QTranslator, QLocale, QUrl
+from qtpy.QtGui import QKeySequence, QTextDocument, QTextCursor, QTextBlock, QDropEvent
+from qtpy.QtCore import QDir, QCoreApplication, Qt, QPoint, Signal, QUrl
 from qtpy.QtWidgets import QWidget, QMessageBox, QFileDialog, QAction, QShortcut, QDialog, QVBoxLayout, QPushButton, \
     QHBoxLayout, QApplication, QLabel
 
@@ -50,6 +50,7 @@ from pmgwidgets import in_unit_test
 from pmgwidgets.widgets.composited import PMGPanel
 from qtpyeditor.ui.gotoline import Ui_DialogGoto
 from qtpyeditor.codeeditor.abstracteditor import PMAbstractEditor
+from qtpyeditor.Utilities.resources import get_icon, install_translator
 
 if TYPE_CHECKING:
     from qtpyeditor.codeedit import PMBaseCodeEdit
@@ -196,11 +197,7 @@ class PMGBaseEditor(PMAbstractEditor):
 
     def __init__(self, parent):
         app = QApplication.instance()
-        trans_editor_tb = QTranslator()
-        app.trans_editor_tb = trans_editor_tb
-        trans_editor_tb.load(
-            os.path.join(os.path.dirname(__file__), 'translations', 'qt_%s.qm' % QLocale.system().name()))
-        app.installTranslator(trans_editor_tb)
+        app.trans_editor_tb = install_translator('qt')  # 所有编辑器共用，只加载和安装一次
 
         super().__init__(parent)
         self.find_dialog: 'FindDialog' = None
@@ -230,6 +227,7 @@ class PMGBaseEditor(PMAbstractEditor):
         self.text_edit.signal_save.connect(self.save)
         self.text_edit.signal_text_modified.connect(lambda: self.slot_modification_changed(True))
         self.text_edit.cursorPositionChanged.connect(self.show_cursor_pos)
+        self.text_edit.signal_large_file_mode_changed.connect(self.show_cursor_pos)
         self.text_edit.signal_file_dropped.connect(lambda name: self.signal_new_requested.emit(name, 0))
         self.find_dialog = FindDialog(parent=self, text_editor=self)
         self.goto_line_dialog = GotoLineDialog(parent=self)
@@ -245,8 +243,13 @@ class PMGBaseEditor(PMAbstractEditor):
     def show_cursor_pos(self):
         row = self.text_edit.textCursor().block().blockNumber()
         col = self.text_edit.textCursor().columnNumber()
-        self.status_label.setText(
-            '行：{row},列:{col}'.format(row=row + 1, col=col + 1))
+        status = '行：{row},列:{col}'.format(row=row + 1, col=col + 1)
+        mode = self.text_edit.large_file_mode
+        if mode == self.text_edit.LARGE_FILE_CHEAP:
+            status += '    大文件模式：简化着色，补全已关闭'
+        elif mode == self.text_edit.LARGE_FILE_PLAIN:
+            status += '    大文件模式：无着色，补全已关闭'
+        self.status_label.setText(status)
 
     def set_shortcut(self):
         pass
@@ -357,6 +360,8 @@ class PMGBaseEditor(PMAbstractEditor):
                 text = fp.read()
                 text, coding = decode(text)
                 self.set_encoding(coding)
+                # 在设置文本之前切换模式，超大文件加载时就不会逐块着色。
+                self.set_large_file_mode(self.text_edit.detect_large_file_mode(text))
                 self.set_text(text)
                 self.set_modified(False)
                 self.text_edit.set_eol_status()
@@ -366,10 +371,20 @@ class PMGBaseEditor(PMAbstractEditor):
             logger.warning(str(e))
 
         self._path = path
+        self.text_edit.path = path  # 补全时jedi按文件路径解析导入
         self.setWindowTitle(self.filename())
         self.last_save_time = time.time()
         self.set_modified(False)
 
+    def set_large_file_mode(self, mode: int) -> None:
+        """
+        设置当前文档的大文件模式，load_file会根据文件大小自动设置，也可以随时切换回正常模式。
+
+        :param mode: PMBaseCodeEdit.LARGE_FILE_OFF、LARGE_FILE_CHEAP或LARGE_FILE_PLAIN
+        :return: None
+        """
+        self.text_edit.set_large_file_mode(mode)
+
     def set_encoding(self, encoding: str):
         """
         设置文本编码，仅支持 ASCII 和 UTF-8
@@ -462,6 +477,7 @@ class PMGBaseEditor(PMAbstractEditor):
             if not path.endswith('.py'):
                 path += '.py'
             self._path = path
+            self.text_edit.path = path
         try:
             with open(self._path, 'wb') as fp:
                 fp.write(self.text().encode('utf-8', errors='ignore'))
@@ -511,6 +527,7 @@ class PMGBaseEditor(PMAbstractEditor):
         :return: None
         """
         self._path = path
+        self.text_edit.path = path
 
         title = self.windowTitle()
         new_title = os.path.basename(self._path)
@@ -544,16 +561,16 @@ class PMGBaseEditor(PMAbstractEditor):
         """
         # QCoreApplication.translate = QCoreApplication.translate
         self.icon_path = os.path.dirname(os.path.dirname(__file__))  # 图标文件路径
-        self._action_format = QAction(QIcon(os.path.join(self.icon_path, 'icons/format.svg')),
+        self._action_format = QAction(get_icon('format.svg'),
                                       QCoreApplication.translate("PMGBaseEditor", 'Format Code'),
                                       self.text_edit)
-        self._action_run_code = QAction(QIcon(os.path.join(self.icon_path, 'icons/run.svg')),
+        self._action_run_code = QAction(get_icon('run.svg'),
                                         QCoreApplication.translate("PMGBaseEditor", 'Run Code'),
                                         self.text_edit)
-        self._action_run_sel_code = QAction(QIcon(os.path.join(self.icon_path, 'icons/python.svg')),
+        self._action_run_sel_code = QAction(get_icon('python.svg'),
                                             QCoreApplication.translate("PMGBaseEditor", 'Run Selected Code'),
                                             self.text_edit)
-        self._action_save = QAction(QIcon(os.path.join(self.icon_path, 'icons/save.svg')),
+        self._action_save = QAction(get_icon('save.svg'),
                                     QCoreApplication.translate("PMGBaseEditor", 'Save'),
                                     self.text_edit)
         self._action_find = QAction(QCoreApplication.translate("PMGBaseEditor", 'Find'), self.text_edit)
@@ -589,7 +606,7 @@ class PMGBaseEditor(PMAbstractEditor):
 
         self._shortcut_goto = QShortcut(QKeySequence('Ctrl+G'), self.text_edit, context=Qt.WidgetShortcut)
 
-        self._action_add_breakpoint = QAction(QIcon(os.path.join(self.icon_path, 'icons/breakpoint.svg')),
+        self._action_add_breakpoint = QAction(get_icon('breakpoint.svg'),
                                               QCoreApplication.translate("PMGBaseEditor", 'Add Breakpoint'),
                                               self.text_edit)
         self._action_remove_breakpoint = QAction(QCoreApplication.translate("PMGBaseEditor", 'Remove Breakpoint'),
@@ -728,9 +745,6 @@ class PMGBaseEditor(PMAbstractEditor):
         pass
 
     def change_color_scheme(self, color_scheme_name: str):
-        if color_scheme_name == 'dark':
-            self.text_edit.load_color_scheme({'keyword': '#b7602f'})
-        elif color_scheme_name == 'light':
-            self.text_edit.load_color_scheme({'keyword': '#101e96'})
-        else:
+        if color_scheme_name not in ('dark', 'light'):
             raise ValueError('unrecognized input color scheme name %s' % color_scheme_name)
+        self.text_edit.set_color_scheme(color_scheme_name)
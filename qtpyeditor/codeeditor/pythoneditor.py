@@ -25,10 +25,28 @@ class PMGPythonEditor(PMGBaseEditor):
         super().__init__(parent=parent)
         edit = PMPythonCodeEdit(self)
         self.set_edit(edit)
+        edit.autocomp_thread.warmup_progress.connect(self.on_warmup_progress)
 
     def update_settings(self, settings: Dict[str, str]):
         pass
 
+    def load_file(self, path: str) -> None:
+        super().load_file(path)
+        self.text_edit.warm_up_completion()
+
+    def on_warmup_progress(self, done: int, total: int, module: str):
+        """
+        在状态栏显示补全预热的进度，完成后恢复显示光标位置
+        :param done:
+        :param total:
+        :param module: 刚刚完成预热的模块
+        :return:
+        """
+        if done < total:
+            self.status_label.setText('正在预热自动补全：{0} ({1}/{2})'.format(module, done, total))
+        else:
+            self.show_cursor_pos()
+
     def open(self, path: str):
         pass
 
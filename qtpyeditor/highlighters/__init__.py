@@ -4,3 +4,4 @@
 # @Email: 1295752786@qq.com
 # @File: __init__.py.py
 from .python import PythonHighlighter
+from .cache import SpanCache
@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/7 9:40
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: cache.py
+"""
+词法分析结果的LRU缓存。
+
+一行的词法分析结果只取决于这一行的文本和上一行结束时的状态，所以以(文本的哈希，文本长度，上一行状态)为键，
+缓存区段列表和本行结束时的状态。滚动、改变窗口大小、切换标签页等操作导致Qt重新调用highlightBlock时，
+命中缓存就只需要重新设置格式，不必再做词法分析。
+键中不保存行文本，长的数据行不会因为缓存而多占一份内存。哈希为64位，再加上长度，1e5个条目中出现冲突的概率不到1e-9，
+冲突的后果只是一行着色错误，下次修改该行时即恢复。
+缓存由所有高亮器共享，占用的内存有上限：每个条目按ENTRY_BYTES加上每个区段SPAN_BYTES估算，
+总量超过max_bytes时淘汰最久未使用的条目。
+后台词法分析线程也会写入缓存，所以所有操作都由一把锁保护。
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from qtpyeditor.highlighters.tokenizer import Span
+
+CacheEntry = Tuple[Tuple[Span, ...], int]
+
+
+class SpanCache(object):
+    # 用tracemalloc测得：一个条目（键、OrderedDict节点、结果元组）约400字节，每个区段元组约100字节
+    ENTRY_BYTES = 400
+    SPAN_BYTES = 100
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param max_bytes: 估算的最大内存占用（字节），默认64MB。短行的条目约700字节，8000字符的数据行约60KB。
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0  # 当前条目估算的内存占用
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Tuple[int, int, int], CacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def entry_bytes(cls, spans: Tuple[Span, ...]) -> int:
+        return cls.ENTRY_BYTES + cls.SPAN_BYTES * len(spans)
+
+    def get(self, text: str, prev_state: int) -> Optional[CacheEntry]:
+        """
+        查找缓存
+        :param text: 行文本
+        :param prev_state: 上一行结束时的状态
+        :return: (区段元组，本行结束时的状态)，未命中时返回None
+        """
+        key = (hash(text), len(text), prev_state)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, text: str, prev_state: int, spans: Tuple[Span, ...], state: int):
+        size = self.entry_bytes(spans)
+        if size > self.max_bytes:
+            return
+        key = (hash(text), len(text), prev_state)
+        entries = self._entries
+        with self._lock:
+            old = entries.pop(key, None)
+            if old is not None:
+                self.bytes -= self.entry_bytes(old[0])
+            entries[key] = (spans, state)
+            self.bytes += size
+            self._evict()
+
+    def resize(self, max_bytes: int):
+        """
+        修改内存上限，超出的部分按最久未使用的顺序淘汰。
+        :param max_bytes:
+        :return:
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        entries = self._entries
+        while self.bytes > self.max_bytes and entries:
+            _, (spans, _) = entries.popitem(last=False)
+            self.bytes -= self.entry_bytes(spans)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        返回命中次数、未命中次数、命中率、当前条目数、估算的内存占用和内存上限，用于确定合适的缓存大小。
+        :return:
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes}
+
+    def __len__(self):
+        return len(self._entries)
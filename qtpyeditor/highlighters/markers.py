@@ -0,0 +1,350 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/8 14:25
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: markers.py
+"""
+代码标记（错误、警告、提示等）的区间索引。
+
+每一行的标记可能相互重叠。这里把它们合并为互不重叠、按起始列排序的区段，每个区段记录覆盖它的
+背景标记种类、是否淡化以及提示文字。着色时每个区段只需设置一次格式，
+鼠标悬停时用二分查找定位区段，时间复杂度为O(log n)。
+
+全部标记按来源（比如某个代码检查工具）分组，以列的形式存放在MarkStore中，每个标记只占十几个字节；
+某一行的BlockMarks在第一次用到时才从列中构建。
+"""
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from qtpyeditor.highlighters.tokenizer import NORMAL, Span
+
+# 标记种类，数值越小越严重。
+ERROR = 1
+WARNING = 2
+HINT = 3
+DEHIGHLIGHT = 4
+MARKERS = (ERROR, WARNING, HINT, DEHIGHLIGHT)
+
+LINE_END = sys.maxsize  # 长度为-1的标记一直延伸到行尾
+
+Mark = Tuple[int, int, int, str]  # (起始列，长度，种类，提示文字)
+
+# start/end: 区段的起止列，end为LINE_END时表示到行尾；
+# marker: 背景标记的种类，多个背景标记重叠时取最严重的一个，没有背景标记时为0；
+# dehighlight: 是否淡化文字；hints: 覆盖该区段的全部标记的提示文字，按严重程度排列。
+MarkSegment = namedtuple('MarkSegment', ['start', 'end', 'marker', 'dehighlight', 'hints'])
+
+
+class BlockMarks(object):
+    """
+    一行中的全部标记。迭代时得到(起始列，长度，种类，提示文字)元组。
+    """
+
+    def __init__(self):
+        self._marks: Set[Mark] = set()
+        self._segments: Optional[List[MarkSegment]] = None
+        self._starts: List[int] = []
+
+    def add(self, start: int, length: int, marker: int, hint: str):
+        if marker not in MARKERS:
+            raise ValueError('unrecognized marker %r' % marker)
+        self._marks.add((start, length, marker, hint))
+        self._segments = None
+
+    def __iter__(self) -> Iterator[Mark]:
+        return iter(self._marks)
+
+    def __len__(self):
+        return len(self._marks)
+
+    def segments(self) -> List[MarkSegment]:
+        """
+        返回合并后的区段。结果会被缓存，直到标记再次改变。
+        :return:
+        """
+        if self._segments is None:
+            self._segments = self._build_segments()
+            self._starts = [segment.start for segment in self._segments]
+        return self._segments
+
+    def _build_segments(self) -> List[MarkSegment]:
+        intervals = []
+        for start, length, marker, hint in self._marks:
+            end = LINE_END if length == -1 else start + length
+            if end > start:
+                intervals.append((start, end, marker, hint))
+        boundaries = sorted({start for start, _, _, _ in intervals} | {end for _, end, _, _ in intervals})
+        segments = []
+        for seg_start, seg_end in zip(boundaries, boundaries[1:]):
+            covering = sorted((marker, hint) for start, end, marker, hint in intervals
+                              if start <= seg_start and seg_end <= end)
+            if not covering:
+                continue
+            background = min((marker for marker, _ in covering if marker != DEHIGHLIGHT), default=0)
+            dehighlight = any(marker == DEHIGHLIGHT for marker, _ in covering)
+            hints = tuple(hint for _, hint in covering)
+            last = segments[-1] if segments else None
+            if last is not None and last.end == seg_start and \
+                    (last.marker, last.dehighlight, last.hints) == (background, dehighlight, hints):
+                segments[-1] = last._replace(end=seg_end)
+            else:
+                segments.append(MarkSegment(seg_start, seg_end, background, dehighlight, hints))
+        return segments
+
+    def find(self, col: int, line_length: int = LINE_END) -> Optional[MarkSegment]:
+        """
+        查找覆盖某一列的区段
+        :param col: 列号
+        :param line_length: 行的长度，到行尾的标记不会覆盖行尾之后的位置
+        :return: 没有标记覆盖该列时返回None
+        """
+        segments = self.segments()
+        index = bisect_right(self._starts, col) - 1
+        if index < 0:
+            return None
+        segment = segments[index]
+        if col < min(segment.end, line_length):
+            return segment
+        return None
+
+
+def _to_column(typecode: str, values) -> array:
+    column = array(typecode)
+    astype = getattr(values, 'astype', None)
+    if astype is not None:
+        # NumPy数组：转换为相同宽度的整数后整块复制，不逐个元素转换。
+        # astype会静默截断浮点数、回绕越界的值，所以先检查类型和取值范围，与array逐个转换时一样报错。
+        if values.dtype.kind not in 'iu':
+            raise ValueError('integer array expected, got dtype %s' % values.dtype)
+        if values.size:
+            bits = column.itemsize * 8 - 1
+            if int(values.min()) < -(1 << bits) or int(values.max()) >= 1 << bits:
+                raise OverflowError('values out of range for typecode %r' % typecode)
+        column.frombytes(astype('i%d' % column.itemsize).tobytes())
+    elif isinstance(values, array) and values.typecode != typecode:
+        column.fromlist(values.tolist())  # array.extend只接受类型码相同的数组
+    else:
+        column.extend(values)
+    return column
+
+
+class MarkColumns(object):
+    """
+    一个来源的全部标记，按行号排序后分列存放。
+    """
+    __slots__ = ('lines', 'starts', 'lengths', 'markers', 'hint_indexes', 'hints', '_sorted')
+
+    def __init__(self):
+        self.lines = array('i')
+        self.starts = array('i')
+        self.lengths = array('i')
+        self.markers = array('b')
+        self.hint_indexes = array('i')  # hints中的下标
+        self.hints: List[str] = []
+        self._sorted = True
+
+    def __len__(self):
+        return len(self.lines)
+
+    def append(self, line: int, start: int, length: int, marker: int, hint: str):
+        if self.lines and line < self.lines[-1]:
+            self._sorted = False
+        self.lines.append(line)
+        self.starts.append(start)
+        self.lengths.append(length)
+        self.markers.append(marker)
+        self.hint_indexes.append(len(self.hints))
+        self.hints.append(hint)
+
+    def sort(self):
+        if self._sorted:
+            return
+        lines = self.lines
+        order = sorted(range(len(lines)), key=lines.__getitem__)
+        for name in ('lines', 'starts', 'lengths', 'markers', 'hint_indexes'):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[i] for i in order]))
+        self._sorted = True
+
+    def rows(self, line: int) -> range:
+        """
+        返回某一行的标记所在的行下标范围
+        :param line:
+        :return:
+        """
+        self.sort()
+        return range(bisect_left(self.lines, line), bisect_right(self.lines, line))
+
+
+class MarkStore(object):
+    """
+    一个文档的全部标记，按来源分组存放。
+    get(行号)返回该行的BlockMarks（按需构建并缓存），接口与Dict[int, BlockMarks]的get、keys一致。
+    """
+
+    def __init__(self):
+        self._sources: Dict[Optional[str], MarkColumns] = {}
+        self._blocks: Dict[int, BlockMarks] = {}
+
+    def __len__(self):
+        return sum(len(columns) for columns in self._sources.values())
+
+    def __bool__(self):
+        return any(len(columns) for columns in self._sources.values())
+
+    def keys(self) -> Set[int]:
+        """
+        返回有标记的行号
+        :return:
+        """
+        lines = set()
+        for columns in self._sources.values():
+            lines.update(columns.lines)
+        return lines
+
+    def get(self, line: int, default=None) -> Optional[BlockMarks]:
+        block_marks = self._blocks.get(line)
+        if block_marks is not None:
+            return block_marks
+        for columns in self._sources.values():
+            rows = columns.rows(line)
+            if not rows:
+                continue
+            if block_marks is None:
+                block_marks = BlockMarks()
+            hints = columns.hints
+            for row in rows:
+                block_marks.add(columns.starts[row], columns.lengths[row], columns.markers[row],
+                                hints[columns.hint_indexes[row]])
+        if block_marks is None:
+            return default
+        self._blocks[line] = block_marks
+        return block_marks
+
+    def add(self, line: int, start: int, length: int, marker: int, hint: str, source: str = None):
+        """
+        添加一个标记
+        :return:
+        """
+        if marker not in MARKERS:
+            raise ValueError('unrecognized marker %r' % marker)
+        columns = self._sources.get(source)
+        if columns is None:
+            columns = self._sources[source] = MarkColumns()
+        columns.append(line, start, length, marker, hint)
+        self._blocks.pop(line, None)
+
+    def extend(self, lines: Sequence[int], starts: Sequence[int], lengths: Sequence[int], markers: Sequence[int],
+               hint_indexes: Sequence[int], hints: List[str], source: str = None, replace: bool = False) -> Set[int]:
+        """
+        批量添加标记。各列可以是list、array.array或整数类型的NumPy数组，长度必须相同，值超出范围时抛出OverflowError。
+        :param lines:
+        :param starts:
+        :param lengths: 为-1时表示一直到行尾
+        :param markers: ERROR、WARNING、HINT或DEHIGHLIGHT
+        :param hint_indexes: 每个标记的提示文字在hints中的下标
+        :param hints:
+        :param source: 标记的来源
+        :param replace: 为True时先删除该来源原有的全部标记，一次代码检查的结果整体替换上一次的结果
+        :return: 标记发生变化的行号
+        """
+        new = MarkColumns()
+        new.lines = _to_column('i', lines)
+        new.starts = _to_column('i', starts)
+        new.lengths = _to_column('i', lengths)
+        new.markers = _to_column('b', markers)
+        new.hint_indexes = _to_column('i', hint_indexes)
+        count = len(new.lines)
+        if not len(new.starts) == len(new.lengths) == len(new.markers) == len(new.hint_indexes) == count:
+            raise ValueError('columns must have the same length')
+        unknown = set(new.markers).difference(MARKERS)
+        if unknown:
+            raise ValueError('unrecognized marker %r' % unknown.pop())
+        if count and not 0 <= min(new.hint_indexes) <= max(new.hint_indexes) < len(hints):
+            raise ValueError('hint index out of range')
+
+        changed = set(new.lines)
+        old = self._sources.get(source)
+        if old is not None:
+            if replace:
+                changed.update(old.lines)
+            else:
+                new.hint_indexes = array('i', [index + len(old.hints) for index in new.hint_indexes])
+                for name in ('lines', 'starts', 'lengths', 'markers', 'hint_indexes'):
+                    column = getattr(old, name)
+                    column.extend(getattr(new, name))
+                    setattr(new, name, column)
+                hints = old.hints + hints
+        new.hints = list(hints)
+        new._sorted = False
+        new.sort()
+        self._sources[source] = new
+        self._invalidate(changed)
+        return changed
+
+    def remove_source(self, source: str = None) -> Set[int]:
+        """
+        删除某个来源的全部标记
+        :param source:
+        :return: 标记发生变化的行号
+        """
+        columns = self._sources.pop(source, None)
+        if columns is None:
+            return set()
+        changed = set(columns.lines)
+        self._invalidate(changed)
+        return changed
+
+    def clear(self) -> Set[int]:
+        """
+        删除全部标记
+        :return: 标记发生变化的行号
+        """
+        changed = self.keys()
+        self._sources = {}
+        self._blocks = {}
+        return changed
+
+    def _invalidate(self, lines: Set[int]):
+        blocks = self._blocks
+        if len(blocks) < len(lines):
+            for line in [line for line in blocks if line in lines]:
+                del blocks[line]
+        else:
+            for line in lines:
+                blocks.pop(line, None)
+
+
+def iter_pieces(spans: Tuple[Span, ...], span_starts: List[int], start: int, end: int) \
+        -> Iterator[Tuple[int, int, int]]:
+    """
+    将[start, end)按照词法区段切分，得到(起始列，结束列，类别)。未被词法区段覆盖的部分属于NORMAL类别。
+    :param spans: 按起始列排序、互不重叠的词法区段
+    :param span_starts: 各词法区段的起始列
+    :param start:
+    :param end:
+    :return:
+    """
+    count = len(spans)
+    index = max(bisect_right(span_starts, start) - 1, 0)
+    pos = start
+    while pos < end:
+        if index >= count:
+            yield pos, end, NORMAL
+            return
+        span_start, span_length, category = spans[index]
+        span_end = span_start + span_length
+        if span_end <= pos:
+            index += 1
+        elif span_start > pos:
+            piece_end = min(span_start, end)
+            yield pos, piece_end, NORMAL
+            pos = piece_end
+        else:
+            piece_end = min(span_end, end)
+            yield pos, piece_end, category
+            pos = piece_end
+            index += 1
@@ -0,0 +1,82 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/9 15:20
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: profiler.py
+"""
+语法高亮的性能统计。
+
+每个高亮器有一个HighlightProfiler。打开后记录着色的块数、词法阶段和标记阶段各自的总耗时、
+单块耗时的分布（按2的幂分桶）以及最慢的若干个块，可以在Python中查询，也可以导出为JSON，
+用于找出导致卡顿的文件。关闭时highlightBlock只多做一次属性判断。
+"""
+import heapq
+import json
+from typing import Any, Dict, List, Tuple
+
+
+class HighlightProfiler(object):
+    SLOWEST_COUNT = 20  # 记录最慢的块的个数
+    BUCKET_COUNT = 16  # 直方图的桶数，第i个桶记录耗时小于2**i微秒的块，最后一个桶记录其余的块
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.blocks = 0
+        self.syntax_time = 0.0
+        self.marker_time = 0.0
+        self.rehighlights = 0
+        self.rehighlight_time = 0.0
+        self.histogram: List[int] = [0] * self.BUCKET_COUNT
+        self._slowest: List[Tuple[float, int, int]] = []  # 小顶堆，元素为(耗时，块号，行长度)
+
+    def record_block(self, block_number: int, length: int, syntax_time: float, marker_time: float):
+        """
+        记录一个块的着色耗时
+        :param block_number:
+        :param length: 行长度
+        :param syntax_time: 词法阶段耗时（秒）
+        :param marker_time: 标记阶段耗时（秒）
+        :return:
+        """
+        self.blocks += 1
+        self.syntax_time += syntax_time
+        self.marker_time += marker_time
+        elapsed = syntax_time + marker_time
+        bucket = min(int(elapsed * 1e6).bit_length(), self.BUCKET_COUNT - 1)
+        self.histogram[bucket] += 1
+        if len(self._slowest) < self.SLOWEST_COUNT:
+            heapq.heappush(self._slowest, (elapsed, block_number, length))
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (elapsed, block_number, length))
+
+    def record_rehighlight(self, elapsed: float):
+        self.rehighlights += 1
+        self.rehighlight_time += elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        返回统计结果。时间单位均为秒；histogram的键为桶的上界（微秒），最后一个桶的上界为inf。
+        :return:
+        """
+        bounds = ['%d' % (2 ** i) for i in range(self.BUCKET_COUNT - 1)] + ['inf']
+        return {'enabled': self.enabled,
+                'blocks': self.blocks,
+                'syntax_time': self.syntax_time,
+                'marker_time': self.marker_time,
+                'mean_block_time': (self.syntax_time + self.marker_time) / self.blocks if self.blocks else 0.0,
+                'rehighlights': self.rehighlights,
+                'rehighlight_time': self.rehighlight_time,
+                'histogram': dict(zip(bounds, self.histogram)),
+                'slowest_blocks': [{'block': block_number, 'length': length, 'time': elapsed}
+                                   for elapsed, block_number, length in sorted(self._slowest, reverse=True)]}
+
+    def to_json(self, **kwargs) -> str:
+        """
+        将统计结果导出为JSON字符串
+        :param kwargs: 传给json.dumps的参数，比如indent
+        :return:
+        """
+        return json.dumps(self.stats(), **kwargs)
@@ -5,15 +5,30 @@
 # @File: python.py
 import sys
 import time
-from typing import Dict, Tuple, List, Set
+from typing import Dict, Tuple, List, Set, Optional, Sequence
 
-from qtpy.QtCore import QRegExp, Qt
+from qtpy.QtCore import Qt, QTimer
 from qtpy.QtWidgets import QApplication
-from qtpy.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont, QCursor, QBrush, QTextBlock
+from qtpy.QtGui import QSyntaxHighlighter, QTextCharFormat, QTextFormat, QColor, QFont, QCursor, QBrush, QTextBlock, \
+    QTextDocument, QTextCursor
+
+from qtpyeditor.highlighters import markers
+from qtpyeditor.highlighters.cache import SpanCache
+from qtpyeditor.highlighters.markers import BlockMarks, MarkStore, iter_pieces
+from qtpyeditor.highlighters.profiler import HighlightProfiler
+from qtpyeditor.highlighters.rules import register_scheme, get_rule_table
+from qtpyeditor.highlighters.threaded import TokenizeThread
+from qtpyeditor.highlighters.tokenizer import tokenize, unpack_state, bracket_delta, has_brackets, BlockState, \
+    CATEGORY_NAMES, KEYWORDS, NORMAL, STATE_NORMAL, DEPTH_MAX, Span
 
 color_scheme_intellij = {'keyword': '#101e96'}
 color_scheme_dark = {'keyword': '#b7602f'}
 
+# 格式中记录类别id和标记的属性。切换配色方案时据此把已有的格式换成新方案中的格式，不需要重新做词法分析。
+CATEGORY_PROPERTY = QTextFormat.UserProperty + 1
+MARKER_PROPERTY = QTextFormat.UserProperty + 2
+DEHIGHLIGHT_PROPERTY = QTextFormat.UserProperty + 3
+
 
 class FontConfig():
     def __init__(self):
@@ -62,21 +77,33 @@ class FontConfig():
     def get_font_size(self) -> int:
         return self.font_size
 
+    def copy(self) -> 'FontConfig':
+        font_cfg = FontConfig()
+        font_cfg.font_size = self.font_size
+        font_cfg.settings = {name: dict(setting) for name, setting in self.settings.items()}
+        return font_cfg
+
 
 class BaseHighlighter(QSyntaxHighlighter):
-    ERROR = 1
-    WARNING = 2
-    HINT = 3
-    DEHIGHLIGHT = 4
+    ERROR = markers.ERROR
+    WARNING = markers.WARNING
+    HINT = markers.HINT
+    DEHIGHLIGHT = markers.DEHIGHLIGHT
 
     HIGHLIGHT_COLOR = {ERROR: QColor(255, 65, 65, 200), WARNING: QColor(255, 255, 65, 100),
                        HINT: QColor(155, 155, 155, 100), DEHIGHLIGHT: QColor(155, 155, 155, 100)}
 
 
 class PythonHighlighter(BaseHighlighter):
-    Rules = []
     Formats = {}
     font_cfg = FontConfig()
+    span_cache = SpanCache()  # 所有编辑器共享的词法分析结果缓存
+    language = 'python'
+    color_scheme = 'default'  # 配色方案名称，见文件末尾的register_scheme
+
+    LAZY_SLICE_SECONDS = 0.01  # 懒惰模式下，每次在事件循环中后台着色的时间预算
+    SNAPSHOT_DELAY_MS = 50  # 后台线程模式下，连续编辑时推迟提交文档快照的时间
+    SNAPSHOT_LINES = 4000  # 后台线程模式下，每次交给后台线程的块数
 
     # _normal_font_cfg = FontConfig('#000000', QFont.Normal)  # 含义分别为颜色和大小
     # _keyword_font_cfg = FontConfig('#000000', QFont.Bold]  # 含义分别为颜色和大小
@@ -87,192 +114,681 @@ class PythonHighlighter(BaseHighlighter):
     def __init__(self, parent=None):
         super(PythonHighlighter, self).__init__(parent)
 
-        self.counter = time.time()
+        self.profiler = HighlightProfiler()
         self.initializeFormats()
         self._rehighlight_hint = True
         self._rehighlight_syntax = True
-        self.KEYWORDS = ["and", "as", "assert", 'async', 'await', "break", "class",
-                    "continue", "def", "del", "elif", "else", "except",
-                    "exec", "finally", "for", "from", "global", "if",
-                    "import", "in", "is", "lambda", "not", "or", "pass",
-                    "raise", "return", "try", "while", "with", "yield"]
-        BUILTINS = ["abs", "all", "any", "basestring", "bool",
-                    "callable", "chr", "classmethod", "cmp", "compile",
-                    "complex", "delattr", "dict", "dir", "divmod",
-                    "enumerate", "eval", "execfile", "exit", "file",
-                    "filter", "float", "frozenset", "getattr", "globals",
-                    "hasattr", "hex", "name", "int", "isinstance",
-                    "issubclass", "iter", "len", "list", "locals", "map",
-                    "max", "min", "object", "oct", "open", "ord", "pow",
-                    "property", "range", "reduce", "repr", "reversed",
-                    "round", "set", "setattr", "slice", "sorted",
-                    "staticmethod", "str", "sum", "super", "tuple", "type",
-                    "vars", "zip"]
-        CONSTANTS = ["False", "True", "None", "NotImplemented",
-                     "Ellipsis"]
-
-        PythonHighlighter.Rules.append((QRegExp(
-            "|".join([r"\b%s\b" % keyword for keyword in self.KEYWORDS])),
-                                        "keyword"))
-        PythonHighlighter.Rules.append((QRegExp(
-            "|".join([r"\b%s\b" % builtin for builtin in BUILTINS])),
-                                        "builtin"))
-        PythonHighlighter.Rules.append((QRegExp(
-            "|".join([r"\b%s\b" % constant
-                      for constant in CONSTANTS])), "constant"))
-        PythonHighlighter.Rules.append((QRegExp(
-            r"\b[+-]?[0-9]+[lL]?\b"
-            r"|\b[+-]?0[xX][0-9A-Fa-f]+[lL]?\b"
-            r"|\b[+-]?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?\b"),
-                                        "number"))
-        # PythonHighlighter.Rules.append((QRegExp(
-        #     r"\bPyQt4\b|\bQt?[A-Z][a-z]\w+\b"), "pyqt"))
-        PythonHighlighter.Rules.append((QRegExp(r"\b@\w+\b"),
-                                        "decorator"))
-        stringRe = QRegExp(r"""(?:'[^']*'|"[^"]*")""")
-        stringRe.setMinimal(True)
-        PythonHighlighter.Rules.append((stringRe, "string"))
-        self.stringRe = QRegExp(r"""(:?"["]".*"["]"|'''.*''')""")
-        self.stringRe.setMinimal(True)
-        PythonHighlighter.Rules.append((self.stringRe, "string"))
-        self.tripleSingleRe = QRegExp(r"""'''(?!")""")
-        self.tripleDoubleRe = QRegExp(r'''"""(?!')''')
+        self._max_line_length = sys.maxsize  # 超过此长度的行不做词法分析
+        self.KEYWORDS = KEYWORDS
 
         self.matched_format = QTextCharFormat()  # 定义高亮格式
         brush = QBrush(Qt.yellow, Qt.SolidPattern)
         self.matched_format.setBackground(brush)
 
-        self.highlight_marks: Dict[int, List[Set[int, int, int, str]]] = {}  # Dict[行号，Tuple[Set[起始，长度，类型,提示内容]]]
+        self.highlight_marks = MarkStore()  # 全部标记，get(行号)返回该行的BlockMarks
+        self._dirty_marker_blocks: Set[int] = set()  # 上次着色之后标记发生变化的行号
+        self._forced_block = -1  # 正在单独重新着色的块号，懒惰模式下不推迟
+        self._depths: List[int] = []  # 各块行尾的括号层数，只保存已经求出的前若干块，见_block_depth
+
+        # 懒惰模式：只立即着色可见区域（含预取边距），其余的块在事件循环中分片完成。
+        self._lazy = False
+        self._visible_range: Tuple[int, int] = (0, 100)  # 可见区域（含预取边距）的首末块号
+        self._lazy_next: Optional[int] = None  # 后台着色尚未完成的第一个块号，None表示全部完成
+        self._lazy_deadline = 0.0  # 后台分片的截止时间，不在分片中时为0
+        self._lazy_limit = sys.maxsize  # 后台分片最多着色到的块号
+        self._last_lexed = -1  # 最近一次进行了词法分析的块号
+        self._lazy_timer = QTimer(self)
+        self._lazy_timer.setInterval(0)
+        self._lazy_timer.timeout.connect(self._highlight_next_slice)
+
+        # 后台线程模式：推迟的块由后台线程进行词法分析，GUI线程只在分片中应用缓存的结果。
+        self._threaded = False
+        self._tokenize_thread: Optional[TokenizeThread] = None
+        self._revision = 0  # 文档内容每变化一次加一，用于识别过期的后台结果
+        self._snapshot_serial = 0  # 最近一次提交给后台线程的快照的编号
+        self._snapshot_revision = -1  # 最近一次提交给后台线程的快照的修订号
+        self._snapshot_range: Tuple[int, int] = (0, -1)  # 当前快照已经交给后台线程的首末块号
+        self._ready_until = -1  # 后台线程对当前快照已分析完成的最后一个块号
+        self._snapshot_timer = QTimer(self)
+        self._snapshot_timer.setSingleShot(True)
+        self._snapshot_timer.setInterval(self.SNAPSHOT_DELAY_MS)
+        self._snapshot_timer.timeout.connect(self._request_snapshot)
+
+        # 切换配色方案：可见区域立即换用新格式，其余的块在事件循环中分片完成。
+        self._recolor_next: Optional[int] = None  # 尚未换用新格式的第一个块号，None表示全部完成
+        self._recolor_timer = QTimer(self)
+        self._recolor_timer.setInterval(0)
+        self._recolor_timer.timeout.connect(self._recolor_next_slice)
+
+        if self.document() is not None:
+            self.document().contentsChange.connect(self._on_contents_change)
 
     # @staticmethod
     def initializeFormats(self):
-        baseFormat = QTextCharFormat()
-        baseFormat.setFontFamily("Source Code Pro")
-        font_cfg = self.font_cfg
-        baseFormat.setFontPointSize(font_cfg.get_font_size())
-        for name in ("normal", "keyword", "builtin", "constant", "decorator", "comment",
-                     "string", "number", "error", "pyqt"):
-            color = font_cfg.get_font_color(name)
-            format = QTextCharFormat(baseFormat)
-            format.setForeground(QColor(color))
-            format.setFontWeight(font_cfg.get_font_bold(name))
-            if name == "comment":
-                format.setFontItalic(True)
-            PythonHighlighter.Formats[name] = format
+        """
+        从共享的注册表中取得规则表。格式表在第一次使用时构建，之后所有高亮器共用。
+        :return:
+        """
+        self.rule_table = get_rule_table(self.language, self.color_scheme)
+        # 按类别id排列的格式，供highlightBlock直接用下标取用。
+        self.category_formats = self.rule_table.formats
+        PythonHighlighter.Formats.update(zip(CATEGORY_NAMES, self.category_formats))
+
+    @classmethod
+    def load_color_scheme(cls, scheme: Dict[str, str]):
+        """
+        修改默认配色方案中的颜色。之后新建的高亮器使用修改后的颜色，已有的高亮器调用reload_formats后生效。
+        :param scheme: Dict[类别名称，颜色]
+        :return:
+        """
+        cls.font_cfg.load_color_scheme(scheme)
+        register_scheme('default', lambda language: build_formats(cls.font_cfg))
+
+    def set_color_scheme(self, scheme: str):
+        """
+        切换到已注册的配色方案，见reload_formats
+        :param scheme:
+        :return:
+        """
+        get_rule_table(self.language, scheme)  # 未注册的方案在这里抛出ValueError
+        self.color_scheme = scheme
+        self.reload_formats()
+
+    def reload_formats(self):
+        """
+        重新从注册表中取得格式表（比如配色方案被重新注册之后），并把文档中已有的格式按类别换成新的格式。
+        不做词法分析：可见区域立即重绘，其余的块在事件循环中分片完成。
+        :return:
+        """
+        rule_table = self.rule_table
+        self.initializeFormats()
+        if self.rule_table is rule_table or self.document() is None:
+            return
+        self._recolor_blocks(self._visible_range[0], self._visible_range[1], sys.maxsize)
+        self._recolor_next = 0
+        self._recolor_timer.start()
+
+    def _recolor_blocks(self, first: int, last: int, deadline: float) -> Optional[int]:
+        """
+        对first到last的块换用新格式，直到截止时间。
+        直接修改各块layout中的格式，最后对处理过的范围只调用一次markContentsDirty；
+        如果逐块调用rehighlightBlock，每块都会单独重新排版，要慢好几倍。
+        :return: 下一个尚未处理的块号，到达文档末尾时为None
+        """
+        document = self.document()
+        block = document.findBlockByNumber(first)
+        start = block.position()
+        end = start
+        while block.isValid() and block.blockNumber() <= last and time.perf_counter() < deadline:
+            self._remap_formats(block)
+            end = block.position() + block.length()
+            block = block.next()
+        if end > start:
+            document.markContentsDirty(start, end - start)
+        return block.blockNumber() if block.isValid() else None
+
+    def _recolor_next_slice(self):
+        if self.document() is None or self._recolor_next is None:
+            self._recolor_next = None
+        else:
+            self._recolor_next = self._recolor_blocks(self._recolor_next, sys.maxsize,
+                                                      time.perf_counter() + self.LAZY_SLICE_SECONDS)
+        if self._recolor_next is None:
+            self._recolor_timer.stop()
+
+    def _remap_formats(self, block: QTextBlock):
+        """
+        把块中已有的格式按其中记录的类别和标记换成当前格式表中的格式。块状态不变，不会引起级联。
+        :param block:
+        :return:
+        """
+        layout = block.layout()
+        format_ranges = layout.formats()
+        if not format_ranges:
+            return
+        formats = self.category_formats
+        mark_formats = self.rule_table.mark_formats
+        for format_range in format_ranges:
+            format = format_range.format
+            if not format.hasProperty(CATEGORY_PROPERTY):
+                continue
+            # PySide把Python的int存为qlonglong，intProperty会返回0，所以这里用property取值。
+            category = format.property(CATEGORY_PROPERTY)
+            if format.hasProperty(MARKER_PROPERTY):
+                key = (category, format.property(MARKER_PROPERTY), format.property(DEHIGHLIGHT_PROPERTY))
+                format = mark_formats.get(key)
+                if format is None:
+                    format = mark_formats[key] = self._build_mark_format(*key)
+            else:
+                format = formats[category]
+            format_range.format = format
+        layout.setFormats(format_ranges)
 
     def highlightBlock(self, text):
-        format = QTextCharFormat()
-        self.setFormat(0, len(text), format)
+        if self._lazy and self._defer_block():
+            return
+        profiling = self.profiler.enabled
+        if profiling:
+            t0 = time.perf_counter()
+        spans = ()
         if self._rehighlight_syntax:
-            NORMAL, TRIPLESINGLE, TRIPLEDOUBLE, ERROR = range(4)
-
-            textLength = len(text)
-            prevState = self.previousBlockState()
-            self.setFormat(0, textLength,
-                           PythonHighlighter.Formats["normal"])
-
-            if text.startswith("Traceback") or text.startswith("Error: "):
-                self.setCurrentBlockState(ERROR)
-                self.setFormat(0, textLength,
-                               PythonHighlighter.Formats["error"])
-                return
-            if (prevState == ERROR and not (text.startswith(sys.ps1) or text.startswith("#"))):
-                self.setCurrentBlockState(ERROR)
-                self.setFormat(0, textLength,
-                               PythonHighlighter.Formats["error"])
-                return
-            for regex, format in PythonHighlighter.Rules:
-                i = regex.indexIn(text)
-                while i >= 0:
-                    length = regex.matchedLength()
-                    self.setFormat(i, length,
-                                   PythonHighlighter.Formats[format])
-                    i = regex.indexIn(text, i + length)
-
-            # Slow but good quality highlighting for comments. For more
-            # speed, comment this out and add the following to __init__:
-            # PythonHighlighter.Rules.append((QRegExp(r"#.*"), "comment"))
-            if not text:
-                pass
-            elif text[0] == "#":
-                self.setFormat(0, len(text), PythonHighlighter.Formats["comment"])
-            else:
-                stack = []
-                for i, c in enumerate(text):
-                    if c in ('"', "'"):
-                        if stack and stack[-1] == c:
-                            stack.pop()
-                        else:
-                            stack.append(c)
-                    elif c == "#" and len(stack) == 0:
-                        self.setFormat(i, len(text), PythonHighlighter.Formats["comment"])
-                        break
-
-            self.setCurrentBlockState(NORMAL)
-
-            if self.stringRe.indexIn(text) != -1:
-                return
-            # This is fooled by triple quotes inside single quoted strings
-            for i, state in ((self.tripleSingleRe.indexIn(text), TRIPLESINGLE),
-                             (self.tripleDoubleRe.indexIn(text), TRIPLEDOUBLE)):
-                if self.previousBlockState() == state:
-                    if i == -1:
-                        i = len(text)
-                        self.setCurrentBlockState(state)
-                    self.setFormat(0, i + 3, PythonHighlighter.Formats["string"])
-                elif i > -1:
-                    self.setCurrentBlockState(state)
-                    self.setFormat(i, len(text), PythonHighlighter.Formats["string"])
-        if self._rehighlight_hint:
+            spans, state = self._lex(text, self.previousBlockState())
+            self.setCurrentBlockState(state)
+            formats = self.category_formats
+            self.setFormat(0, len(text), formats[NORMAL])
+            for start, length, category in spans:
+                self.setFormat(start, length, formats[category])
+        if profiling:
+            t1 = time.perf_counter()
+        block_number = -1
+        if self._rehighlight_hint and self.highlight_marks:
             block_number = self.currentBlock().blockNumber()
-            t0 = time.time()
-            if block_number in self.highlight_marks.keys():
-                marks_set = self.highlight_marks[block_number]
-                for mark in marks_set:
-                    highlight_marker = mark[2]
-                    start_col = mark[0]
-                    color = self.HIGHLIGHT_COLOR[highlight_marker]
-                    if mark[1] != -1:
-                        to_col = mark[0] + mark[1]
-                    else:
-                        to_col = len(text)
-
-                    if 0 < highlight_marker <= 3:
-                        brush = QBrush(color, Qt.SolidPattern)
-                        for i in range(start_col, to_col):
-                            format = self.format(i)
-                            format.setBackground(brush)
-                            self.setFormat(i, 1, format)
-                    elif highlight_marker == self.DEHIGHLIGHT:
-                        for i in range(start_col, to_col):
-                            format = self.format(i)
-                            format.setForeground(self.HIGHLIGHT_COLOR[highlight_marker])
-                            self.setFormat(i, 1, format)
-                    else:
-                        raise ValueError
-        t1 = time.time()
-        self.counter += t1 - t0
+            block_marks = self.highlight_marks.get(block_number)
+            if block_marks:
+                self._apply_marks(text, spans, block_marks)
+        if profiling:
+            t2 = time.perf_counter()
+            if block_number < 0:
+                block_number = self.currentBlock().blockNumber()
+            self.profiler.record_block(block_number, len(text), t1 - t0, t2 - t1)
+
+    def _lex(self, text: str, prev_state: int) -> Tuple[Tuple[Span, ...], int]:
+        """
+        取得一行的区段和行尾状态，优先从缓存中取得
+        :param text:
+        :param prev_state:
+        :return:
+        """
+        cached = self.span_cache.get(text, prev_state)
+        if cached is None and len(text) > self._max_line_length:
+            # 超长的行（比如生成的数据）按普通文本显示，并沿用上一行的状态。
+            cached = ((), max(prev_state, STATE_NORMAL))
+        if cached is None:
+            spans, state = tokenize(text, prev_state, self.rule_table.lexer)
+            cached = (tuple(spans), state)
+            self.span_cache.put(text, prev_state, *cached)
+        return cached
+
+    def _apply_marks(self, text: str, spans: Tuple[Tuple[int, int, int], ...], block_marks: BlockMarks):
+        """
+        对一行应用标记。每个合并后的标记区段与词法区段的每个交集只设置一次格式。
+        :param text:
+        :param spans: 本行的词法区段，未做语法高亮时为空
+        :param block_marks:
+        :return:
+        """
+        length = len(text)
+        span_starts = [span[0] for span in spans]
+        syntax = self._rehighlight_syntax
+        mark_formats = self.rule_table.mark_formats
+        for segment in block_marks.segments():
+            end = min(segment.end, length)
+            if segment.start >= end:
+                continue
+            for start, piece_end, category in iter_pieces(spans, span_starts, segment.start, end):
+                key = (category if syntax else -1, segment.marker, segment.dehighlight)
+                format = mark_formats.get(key)
+                if format is None:
+                    format = mark_formats[key] = self._build_mark_format(*key)
+                self.setFormat(start, piece_end - start, format)
+
+    def _build_mark_format(self, category: int, marker: int, dehighlight: bool) -> QTextCharFormat:
+        """
+        构建类别格式叠加标记后的格式。结果缓存在规则表中，所有高亮器共用。
+        :param category: 类别id，-1表示不做语法高亮
+        :param marker: 背景标记，0表示没有
+        :param dehighlight: 是否淡化前景色
+        :return:
+        """
+        format = QTextCharFormat(self.category_formats[category]) if category >= 0 else QTextCharFormat()
+        format.setProperty(CATEGORY_PROPERTY, category)
+        format.setProperty(MARKER_PROPERTY, marker)
+        format.setProperty(DEHIGHLIGHT_PROPERTY, dehighlight)
+        if marker:
+            format.setBackground(QBrush(self.HIGHLIGHT_COLOR[marker], Qt.SolidPattern))
+        if dehighlight:
+            format.setForeground(self.HIGHLIGHT_COLOR[self.DEHIGHLIGHT])
+        return format
+
+    def _defer_block(self) -> bool:
+        """
+        懒惰模式下判断当前块是否推迟着色。
+        推迟的块不修改块状态，因此Qt不会继续向后级联；块号会被记录下来，交给后台分片完成。
+        :return: True表示推迟
+        """
+        block_number = self.currentBlock().blockNumber()
+        if self._lazy_deadline:
+            # 分片请求的块总是着色；由它级联到的块只在时间预算和可用范围之内着色。
+            if block_number == self._forced_block or \
+                    (block_number <= self._lazy_limit and time.perf_counter() < self._lazy_deadline):
+                if self._lazy_next is not None and block_number >= self._lazy_next:
+                    self._lazy_next = block_number + 1
+                self._last_lexed = block_number
+                return False
+        elif block_number == self._forced_block:
+            self._last_lexed = block_number
+            return False
+        elif self._visible_range[0] <= block_number <= self._visible_range[1]:
+            if self._lazy_next is not None and block_number < self._lazy_next:
+                # 编辑可能增删了块，之后的块号会整体移动，所以后台着色要从这里之后重新开始。
+                self._lazy_next = block_number + 1
+            self._last_lexed = block_number
+            return False
+        if self._lazy_next is None or block_number < self._lazy_next:
+            self._lazy_next = block_number
+        if self._threaded:
+            self._schedule_snapshot()
+        elif not self._lazy_timer.isActive():
+            self._lazy_timer.start()
+        return True
+
+    def _highlight_next_slice(self, budget: float = None):
+        """
+        后台着色的一个分片。从第一个未完成的块开始，依次向后着色，直到用完时间预算。
+        :param budget: 时间预算（秒），默认为LAZY_SLICE_SECONDS
+        :return:
+        """
+        document = self.document()
+        if document is None or self._lazy_next is None:
+            self._lazy_next = None
+            self._lazy_timer.stop()
+            return
+        # 后台线程模式下只应用已经分析完成的块，其余的等待下一批结果；同步完成全部着色时不受此限制。
+        limit = self._lazy_limit = self._ready_until if self._threaded and budget is None else sys.maxsize
+        self._lazy_deadline = time.perf_counter() + (self.LAZY_SLICE_SECONDS if budget is None else budget)
+        try:
+            block = document.findBlockByNumber(self._lazy_next)
+            while block.isValid() and self._lazy_next <= limit and time.perf_counter() < self._lazy_deadline:
+                self._forced_block = self._lazy_next
+                self.rehighlightBlock(block)
+                block = document.findBlockByNumber(self._lazy_next)
+        finally:
+            self._lazy_deadline = 0.0
+            self._forced_block = -1
+        if not block.isValid():
+            self._lazy_next = None
+            self._lazy_timer.stop()
+        elif self._lazy_next > limit:
+            self._lazy_timer.stop()
+
+    def _schedule_snapshot(self):
+        """
+        后台线程模式下有块被推迟时调用。快照过期或者不包含第一个未着色的块时，
+        在停止编辑SNAPSHOT_DELAY_MS毫秒后提交新的快照，否则如果已有可应用的结果，启动分片。
+        :return:
+        """
+        first, last = self._snapshot_range
+        if self._snapshot_revision != self._revision or \
+                (self._lazy_next is not None and not first <= self._lazy_next <= last):
+            self._snapshot_timer.start()
+        elif self._lazy_next is not None and self._lazy_next <= self._ready_until and not self._lazy_timer.isActive():
+            self._lazy_timer.start()
+
+    def _request_snapshot(self):
+        """
+        从第一个未着色的块开始提交新的快照。快照不复制整个文档，而是每次只把SNAPSHOT_LINES个块交给后台线程，
+        后台线程分析完一段之后再提交下一段（见_on_batch_ready），所以编辑之后GUI线程的开销与文档大小无关。
+        :return:
+        """
+        document = self.document()
+        if document is None or self._tokenize_thread is None or self._lazy_next is None:
+            return
+        block = document.findBlockByNumber(self._lazy_next)
+        if not block.isValid():
+            return
+        self._snapshot_serial += 1
+        self._snapshot_revision = self._revision
+        self._snapshot_range = (self._lazy_next, self._lazy_next - 1)
+        self._ready_until = -1
+        self._submit_lines(block, block.previous().userState())
+
+    def _submit_lines(self, block: QTextBlock, prev_state: int):
+        """
+        把从block开始、最多SNAPSHOT_LINES个块的文本作为当前快照的下一段交给后台线程。文本用一个选区一次读出。
+        :param block:
+        :param prev_state: block之前一块的状态
+        :return:
+        """
+        document = self.document()
+        first = block.blockNumber()
+        last = min(first + self.SNAPSHOT_LINES, document.blockCount()) - 1
+        cursor = QTextCursor(block)
+        cursor.setPosition(document.findBlockByNumber(last).position(), QTextCursor.KeepAnchor)
+        cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+        self._snapshot_range = (self._snapshot_range[0], last)
+        self._tokenize_thread.request(self._snapshot_serial, first, prev_state, cursor.selectedText().split('\u2029'))
+
+    def _on_batch_ready(self, serial: int, last: int, state: int):
+        """
+        后台线程完成了一批块的词法分析。不是最新快照的结果或者快照已经过期时直接丢弃。
+        一段分析完成时，以该段最后一块的状态接着提交下一段。
+        :param serial:
+        :param last:
+        :param state:
+        :return:
+        """
+        if serial != self._snapshot_serial or self._snapshot_revision != self._revision:
+            if self._lazy_next is not None:
+                self._schedule_snapshot()
+            return
+        self._ready_until = last
+        if last == self._snapshot_range[1]:
+            block = self.document().findBlockByNumber(last + 1)
+            if block.isValid():
+                self._submit_lines(block, state)
+        if self._lazy_next is not None and self._lazy_next <= last and not self._lazy_timer.isActive():
+            self._lazy_timer.start()
+
+    def _on_contents_change(self, position: int, chars_removed: int, chars_added: int):
+        if self._depths:
+            del self._depths[self.document().findBlock(position).blockNumber():]
+        # QSyntaxHighlighter自身的槽先于此处执行，编辑引起的推迟发生在修订号增加之前，所以这里要再检查一次。
+        self._revision += 1
+        if self._threaded and self._lazy_next is not None:
+            self._schedule_snapshot()
+
+    def set_threaded(self, threaded: bool):
+        """
+        设置后台线程词法分析模式，适合打开大文件时使用。打开时会同时打开懒惰模式：
+        可见区域仍在GUI线程中立即着色，其余的块交给后台线程分析，GUI线程分批应用结果。
+        :param threaded:
+        :return:
+        """
+        if threaded == self._threaded:
+            return
+        if threaded:
+            self.set_lazy(True)
+            thread = TokenizeThread(self.span_cache, self.rule_table.lexer, self)
+            thread.max_line_length = self._max_line_length
+            thread.batch_ready.connect(self._on_batch_ready)
+            # 线程是高亮器的子对象，高亮器随文档销毁时必须先让线程结束。
+            self.destroyed.connect(lambda: thread.on_exit())
+            thread.start()
+            self._tokenize_thread = thread
+            self._threaded = True
+            self._snapshot_revision = -1
+            if self._lazy_next is not None:
+                self._schedule_snapshot()
+        else:
+            self._threaded = False
+            self._snapshot_timer.stop()
+            self._tokenize_thread.on_exit()
+            self._tokenize_thread = None
+            if self._lazy_next is not None:
+                self._lazy_timer.start()
+
+    def setDocument(self, document: Optional[QTextDocument]):
+        """
+        contentsChange的连接随文档一起转移；旧文档的后台结果按修订号丢弃，括号层数全部重新求。
+        :param document:
+        :return:
+        """
+        old_document = self.document()
+        if old_document is not None:
+            old_document.contentsChange.disconnect(self._on_contents_change)
+        self._depths = []
+        QSyntaxHighlighter.setDocument(self, document)
+        self._revision += 1
+        if document is not None:
+            document.contentsChange.connect(self._on_contents_change)
+
+    def is_threaded(self) -> bool:
+        return self._threaded
+
+    def set_lazy(self, lazy: bool):
+        """
+        设置懒惰着色模式。关闭时会同步完成所有尚未着色的块，并同时关闭后台线程模式。
+        :param lazy:
+        :return:
+        """
+        if not lazy and self._threaded:
+            self.set_threaded(False)
+        if not lazy and self._lazy_next is not None:
+            self._highlight_next_slice(budget=float('inf'))
+        self._lazy = lazy
+
+    def is_lazy(self) -> bool:
+        return self._lazy
+
+    def is_pending(self) -> bool:
+        """
+        返回后台是否还有尚未着色的块
+        :return:
+        """
+        return self._lazy_next is not None
+
+    def block_state(self, block_number: int) -> Optional[BlockState]:
+        """
+        读取某块行尾的词法上下文（模式、未闭合的括号层数、字符串前缀、是否续行）。
+        续行判断、折叠、自动缩进等功能可以直接使用。括号层数的求法见_block_depth。
+        懒惰模式下尚未着色的块返回None；is_pending()为True时，已着色的块的状态也可能还没有更新。
+        :param block_number:
+        :return:
+        """
+        document = self.document()
+        if document is None:
+            return None
+        block = document.findBlockByNumber(block_number)
+        if not block.isValid() or block.userState() < 0:
+            return None
+        return unpack_state(block.userState(), self._block_depth(block))
+
+    def block_bracket_delta(self, block_number: int) -> Optional[int]:
+        """
+        求某块代码部分的括号增减数，大于0表示这一行新开了未闭合的括号。只看这一行，不需要像括号层数那样从头累加。
+        尚未着色的块返回None。
+        :param block_number:
+        :return:
+        """
+        document = self.document()
+        if document is None:
+            return None
+        block = document.findBlockByNumber(block_number)
+        if not block.isValid() or block.userState() < 0:
+            return None
+        return self._line_bracket_delta(block.text(), block.userState(), block.previous().userState())[0]
+
+    def _line_bracket_delta(self, text: str, state: int, prev_state: int) -> Tuple[int, int]:
+        """
+        求一行的括号增减数。没有括号的行不需要区段，有括号的行从缓存中取得区段。
+        :param text:
+        :param state: 该块的状态，尚未着色时为-1，此时按prev_state做词法分析求出
+        :param prev_state: 上一块的状态
+        :return: (括号增减数，该块的状态)
+        """
+        if len(text) > self._max_line_length:
+            # 与highlightBlock一致，超长的行不做词法分析，也不计括号
+            return 0, state if state >= 0 else max(prev_state, STATE_NORMAL)
+        spans = ()
+        if state < 0 or has_brackets(text):
+            spans, lexed_state = self._lex(text, prev_state)
+            if state < 0:
+                state = lexed_state
+        return bracket_delta(text, spans, state), state
+
+    def _block_depth(self, block: QTextBlock) -> int:
+        """
+        求某块行尾未闭合的括号层数。括号层数不在块状态中（见tokenizer），而是从第一块开始逐块累加各行的括号增减数。
+        前若干块的结果保存在_depths中，下次从保存的最后一块接着求，文档被修改时从修改处截断，
+        所以顺序读取各块时每块为O(1)，修改之后第一次读取后面的块时要从修改处累加到该块。
+        懒惰模式下从第一个未完成着色的块开始，块状态还可能改变，所以之后的结果只计算，不保存。
+        :param block:
+        :return:
+        """
+        depths = self._depths
+        number = block.blockNumber()
+        if number < len(depths):
+            return depths[number]
+        stable = self._lazy_next if self._lazy_next is not None else sys.maxsize
+        current = self.document().findBlockByNumber(len(depths))
+        depth = depths[-1] if depths else 0
+        prev_state = current.previous().userState()  # 第一块之前为-1，与previousBlockState()一致
+        for current_number in range(len(depths), number + 1):
+            delta, prev_state = self._line_bracket_delta(current.text(), current.userState(), prev_state)
+            depth = min(max(depth + delta, 0), DEPTH_MAX)
+            if current_number < stable:
+                depths.append(depth)
+            current = current.next()
+        return depth
+
+    def set_visible_range(self, first: int, last: int):
+        """
+        设置可见区域（含预取边距）的首末块号。
+        如果其中有尚未着色的块，立即对它们着色。此时前面的块可能还没有完成，块状态只是估计值，
+        后台分片到达这里时会用正确的状态重新着色。
+        :param first:
+        :param last:
+        :return:
+        """
+        self._visible_range = (max(first, 0), last)
+        document = self.document()
+        if not self._lazy or self._lazy_next is None or document is None:
+            return
+        block_number = max(first, self._lazy_next)
+        while block_number <= last:
+            block = document.findBlockByNumber(block_number)
+            if not block.isValid():
+                break
+            self.rehighlightBlock(block)
+            block_number = max(block_number, self._last_lexed) + 1
 
     def rehighlight(self):
-        t0 = time.time()
-        self.counter = 0
-        QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-        QSyntaxHighlighter.rehighlight(self)
-        QApplication.restoreOverrideCursor()
-        t1 = time.time()
-        print(t1 - t0, 'time.time,elapsed for rendering code', self.counter)
+        t0 = time.perf_counter()
+        self._depths = []
+        if self._lazy:
+            # 懒惰模式下不让Qt逐块调用highlightBlock（即使每块都被推迟，大文件也要数秒），
+            # 只立即重新着色可见区域，其余的块从头开始交给后台分片。
+            self._lazy_next = 0
+            self.set_visible_range(*self._visible_range)
+            if self._threaded:
+                self._schedule_snapshot()
+            else:
+                self._lazy_timer.start()
+        else:
+            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+            QSyntaxHighlighter.rehighlight(self)
+            QApplication.restoreOverrideCursor()
+        if self.profiler.enabled:
+            self.profiler.record_rehighlight(time.perf_counter() - t0)
+
+    def set_max_line_length(self, length: int):
+        """
+        设置做词法分析的最大行长度，更长的行按普通文本显示。修改后需要调用rehighlight才会生效。
+        :param length: 为-1时不限制
+        :return:
+        """
+        self._max_line_length = sys.maxsize if length < 0 else length
+        if self._tokenize_thread is not None:
+            self._tokenize_thread.max_line_length = self._max_line_length
+
+    def set_profiling(self, enabled: bool):
+        """
+        打开或关闭性能统计。打开时会清空之前的统计结果。
+        :param enabled:
+        :return:
+        """
+        if enabled and not self.profiler.enabled:
+            self.profiler.reset()
+        self.profiler.enabled = enabled
+
+    def profile_stats(self) -> Dict[str, object]:
+        """
+        返回性能统计结果，见HighlightProfiler.stats
+        :return:
+        """
+        return self.profiler.stats()
+
+    def rehighlight_dirty(self):
+        """
+        只对标记发生变化的行重新着色。
+        如果某一行重新着色后块状态改变（比如多行字符串的状态），Qt会自动继续对后面的行着色。
+        :return:
+        """
+        document = self.document()
+        dirty_blocks, self._dirty_marker_blocks = self._dirty_marker_blocks, set()
+        if document is None:
+            return
+        try:
+            for block_number in sorted(dirty_blocks):
+                block = document.findBlockByNumber(block_number)
+                if not block.isValid():
+                    break
+                self._forced_block = block_number
+                self.rehighlightBlock(block)
+        finally:
+            self._forced_block = -1
+
+    def clearHighlight(self):
+        """
+        清除全部标记，原先带有标记的行会在下一次rehighlight_dirty时重新着色。
+        :return:
+        """
+        self._dirty_marker_blocks.update(self.highlight_marks.clear())
 
     def registerHighlight(self, line_no: int, start: int, length: int, marker: int, hint: str):
         """
-        内置的集合数据结构支持整体去重。
+        注册一个标记。同一行的标记会被合并为互不重叠的区段，完全相同的标记只保留一个。
         :param line_no:
         :param start:
-        :param length:
-        :param marker:
+        :param length: 为-1时表示一直到行尾
+        :param marker: ERROR、WARNING、HINT或DEHIGHLIGHT
+        :param hint: 鼠标悬停时显示的提示
         :return:
         """
-        if not isinstance(self.highlight_marks.get(line_no), list):
-            self.highlight_marks[line_no] = set()
-        self.highlight_marks[line_no].add((start, length, marker, hint))
-        # print(start, length)
-        # print(self.highlight_marks)
+        self.highlight_marks.add(line_no, start, length, marker, hint)
+        self._dirty_marker_blocks.add(line_no)
+
+    def register_highlights(self, lines: Sequence[int], starts: Sequence[int], lengths: Sequence[int],
+                            markers: Sequence[int], hint_indexes: Sequence[int], hints: List[str],
+                            source: str = None, replace: bool = False):
+        """
+        批量注册标记，然后只对标记发生变化的行重新着色一次。
+        各列可以是list、array.array或NumPy数组，见MarkStore.extend。
+        :param lines:
+        :param starts:
+        :param lengths: 为-1时表示一直到行尾
+        :param markers: ERROR、WARNING、HINT或DEHIGHLIGHT
+        :param hint_indexes: 每个标记的提示文字在hints中的下标
+        :param hints:
+        :param source: 标记的来源，比如代码检查工具的名称
+        :param replace: 为True时这些标记整体替换该来源原有的标记
+        :return:
+        """
+        self._dirty_marker_blocks.update(
+            self.highlight_marks.extend(lines, starts, lengths, markers, hint_indexes, hints, source, replace))
+        self.rehighlight_dirty()
+
+
+def build_formats(font_cfg: FontConfig) -> Tuple[QTextCharFormat, ...]:
+    """
+    根据字体设置构建按类别id排列的格式元组
+    :param font_cfg:
+    :return:
+    """
+    baseFormat = QTextCharFormat()
+    baseFormat.setFontFamily("Source Code Pro")
+    baseFormat.setFontPointSize(font_cfg.get_font_size())
+    formats = []
+    for category, name in enumerate(CATEGORY_NAMES):
+        format = QTextCharFormat(baseFormat)
+        format.setProperty(CATEGORY_PROPERTY, category)
+        format.setForeground(QColor(font_cfg.get_font_color(name)))
+        format.setFontWeight(font_cfg.get_font_bold(name))
+        if name == "comment":
+            format.setFontItalic(True)
+        formats.append(format)
+    return tuple(formats)
+
+
+def _scheme_factory(overrides: Dict[str, str]):
+    def factory(language: str) -> Tuple[QTextCharFormat, ...]:
+        font_cfg = PythonHighlighter.font_cfg.copy()
+        font_cfg.load_color_scheme(overrides)
+        return build_formats(font_cfg)
+
+    return factory
+
+
+register_scheme('default', lambda language: build_formats(PythonHighlighter.font_cfg))
+register_scheme('light', _scheme_factory(color_scheme_intellij))
+register_scheme('dark', _scheme_factory(color_scheme_dark))
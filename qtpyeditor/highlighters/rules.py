@@ -0,0 +1,96 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/8 16:05
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: rules.py
+"""
+进程内共享的高亮规则注册表。
+
+语言的词法规则（预编译的正则表达式及分组到类别的映射）与配色方案的格式表都只在第一次使用时构建一次，
+之后以不可变的RuleTable形式由所有高亮器共享。打开多少个编辑器，每一行的着色开销都不变。
+词法规则按语言缓存，不同配色方案共用同一份编译结果。
+"""
+import threading
+from collections import namedtuple
+from typing import Any, Callable, Dict, Tuple
+
+# pattern: 预编译的正则表达式；group_categories: 下标为match.lastindex，值为类别id；
+# comment_group/triple_group: 注释和三引号分组的序号。本部分不依赖Qt，可以在任何线程中使用。
+LexerRules = namedtuple('LexerRules', ['language', 'pattern', 'group_categories', 'comment_group', 'triple_group'])
+
+# lexer: 该语言的LexerRules；formats: 按类别id排列的格式元组；
+# mark_formats: 类别格式叠加标记后的格式，由高亮器在第一次用到时填入，随规则表一起失效。
+RuleTable = namedtuple('RuleTable', ['language', 'scheme', 'lexer', 'formats', 'mark_formats'])
+
+_lock = threading.RLock()
+_language_factories: Dict[str, Callable[[], LexerRules]] = {}
+_scheme_factories: Dict[str, Callable[[str], Tuple[Any, ...]]] = {}
+_lexers: Dict[str, LexerRules] = {}
+_tables: Dict[Tuple[str, str], RuleTable] = {}
+
+
+def register_language(language: str, factory: Callable[[], LexerRules]):
+    """
+    注册一种语言。factory在第一次用到该语言时才会被调用。
+    :param language:
+    :param factory: 无参数，返回LexerRules
+    :return:
+    """
+    with _lock:
+        _language_factories[language] = factory
+        _lexers.pop(language, None)
+        for key in [key for key in _tables if key[0] == language]:
+            del _tables[key]
+
+
+def register_scheme(scheme: str, factory: Callable[[str], Tuple[Any, ...]]):
+    """
+    注册一个配色方案。重新注册同名方案会使已缓存的格式表失效，之后新建的高亮器使用新的格式表。
+    :param scheme:
+    :param factory: 参数为语言名，返回按类别id排列的格式元组。格式一般是Qt对象，所以只在GUI线程中构建。
+    :return:
+    """
+    with _lock:
+        _scheme_factories[scheme] = factory
+        for key in [key for key in _tables if key[1] == scheme]:
+            del _tables[key]
+
+
+def get_lexer_rules(language: str) -> LexerRules:
+    """
+    获取某种语言的词法规则，第一次调用时编译。
+    :param language:
+    :return:
+    """
+    rules = _lexers.get(language)
+    if rules is None:
+        with _lock:
+            rules = _lexers.get(language)
+            if rules is None:
+                try:
+                    factory = _language_factories[language]
+                except KeyError:
+                    raise ValueError('unrecognized language %r' % language)
+                rules = _lexers[language] = factory()
+    return rules
+
+
+def get_rule_table(language: str, scheme: str) -> RuleTable:
+    """
+    获取某种语言在某个配色方案下的规则表，第一次调用时构建。
+    :param language:
+    :param scheme:
+    :return:
+    """
+    key = (language, scheme)
+    table = _tables.get(key)
+    if table is None:
+        with _lock:
+            table = _tables.get(key)
+            if table is None:
+                try:
+                    factory = _scheme_factories[scheme]
+                except KeyError:
+                    raise ValueError('unrecognized color scheme %r' % scheme)
+                table = _tables[key] = RuleTable(language, scheme, get_lexer_rules(language), tuple(factory(language)), {})
+    return table
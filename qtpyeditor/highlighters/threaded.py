@@ -0,0 +1,92 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/9 10:30
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: threaded.py
+"""
+在后台线程中进行词法分析。
+
+GUI线程把文档中尚未着色的一段块（各行文本、起始块号和前一块的状态）连同快照编号交给后台线程，
+后台线程逐行分析，把结果写入共享的SpanCache，每完成一批就发出batch_ready信号。GUI线程收到信号后，只需在有限的时间片内对这批块调用rehighlightBlock，
+此时highlightBlock全部命中缓存，只设置格式而不做词法分析。
+缓存以(行文本，上一行状态)为键，所以即使快照已经过期，写入的结果也是正确的；过期只意味着批次信号会被丢弃。
+"""
+import sys
+import threading
+from typing import List, Optional, Tuple
+
+from qtpy.QtCore import QThread, Signal
+
+from qtpyeditor.highlighters.cache import SpanCache
+from qtpyeditor.highlighters.rules import LexerRules
+from qtpyeditor.highlighters.tokenizer import tokenize, STATE_NORMAL
+
+
+class TokenizeThread(QThread):
+    """
+    后台词法分析线程。没有请求时在条件变量上等待，不占用CPU。
+    新的请求会使正在进行的分析在当前批次结束后中止，直接转去处理最新的快照。
+    """
+    batch_ready = Signal(int, int, int)  # 快照编号；已分析完成的最后一个块号；该块的状态
+
+    BATCH_LINES = 2000
+
+    def __init__(self, cache: SpanCache, rules: LexerRules, parent=None):
+        super(TokenizeThread, self).__init__(parent)
+        self.cache = cache
+        self.rules = rules
+        self.max_line_length = sys.maxsize  # 与高亮器一致，更长的行不做分析，也不写入缓存
+        self.stop_flag = False
+        self._condition = threading.Condition()
+        self._request: Optional[Tuple[int, int, int, List[str]]] = None
+
+    def request(self, serial: int, first: int, prev_state: int, lines: List[str]):
+        """
+        提交一份快照。尚未开始处理的旧快照会被直接替换。
+        :param serial: 快照编号，随batch_ready一起发回
+        :param first: 第一行的块号
+        :param prev_state: 第一行之前一块的状态，第一块为-1
+        :param lines: 从first开始的各块的文本
+        :return:
+        """
+        with self._condition:
+            self._request = (serial, first, prev_state, lines)
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._request is None and not self.stop_flag:
+                    self._condition.wait()
+                if self.stop_flag:
+                    return
+                request = self._request
+                self._request = None
+            self._tokenize_snapshot(*request)
+
+    def _tokenize_snapshot(self, serial: int, first: int, prev_state: int, lines: List[str]):
+        cache = self.cache
+        rules = self.rules
+        for batch_start in range(0, len(lines), self.BATCH_LINES):
+            for text in lines[batch_start:batch_start + self.BATCH_LINES]:
+                if self.stop_flag:  # 退出时不必等本批次分析完
+                    return
+                if len(text) > self.max_line_length:
+                    prev_state = max(prev_state, STATE_NORMAL)
+                    continue
+                spans, state = tokenize(text, prev_state, rules)
+                cache.put(text, prev_state, tuple(spans), state)
+                prev_state = state
+            self.batch_ready.emit(serial, first + min(batch_start + self.BATCH_LINES, len(lines)) - 1, prev_state)
+            if self._request is not None or self.stop_flag:
+                return
+
+    def on_exit(self):
+        """
+        结束线程并等待线程退出。每分析一行之前检查stop_flag，所以只需等待当前这一行分析完成。
+        :return:
+        """
+        with self._condition:
+            self.stop_flag = True
+            self._condition.notify()
+        self.wait()
@@ -0,0 +1,249 @@
+# -*- coding:utf-8 -*-
+# @Time: 2021/2/6 10:12
+# @Author: Zhanyi Hou
+# @Email: 1295752786@qq.com
+# @File: tokenizer.py
+"""
+单遍扫描的Python词法分析器。
+
+原先的高亮方法是对每一行依次运行多条QRegExp规则，再逐字符地查找注释，最后处理三引号字符串，
+同一行要被扫描十余遍。这里把所有规则合并为一个预编译的正则表达式，从左到右只扫描一遍，
+输出(起始列，长度，类别)形式的区段列表以及该行结束时的状态。
+本模块不依赖Qt，可以在任何线程中调用。
+"""
+import re
+import sys
+from collections import namedtuple
+from typing import List, Sequence, Tuple
+
+from qtpyeditor.highlighters.rules import LexerRules, register_language, get_lexer_rules
+
+# 词法类别。数值即为类别id，CATEGORY_NAMES中对应的名称与FontConfig中的设置项一致。
+NORMAL = 0
+KEYWORD = 1
+BUILTIN = 2
+CONSTANT = 3
+DECORATOR = 4
+COMMENT = 5
+STRING = 6
+NUMBER = 7
+ERROR = 8
+PYQT = 9
+
+CATEGORY_NAMES = ("normal", "keyword", "builtin", "constant", "decorator", "comment",
+                  "string", "number", "error", "pyqt")
+
+# 行结束时的状态，与QSyntaxHighlighter的blockState对应。状态是一个非负整数，各位的含义为：
+#   0-1位：模式，即下面的STATE_*
+#   2-4位：行尾尚未结束的三引号字符串的前缀，PREFIX_*的组合
+#   5位：行尾有续行的反斜杠
+# 没有前缀和续行时，状态就等于模式。
+# 括号层数不放在状态中：块状态改变时Qt会接着重新着色下一块，如果状态中含有括号层数，
+# 输入一个未闭合的括号就会使之后所有块重新着色。各行的括号增减数由bracket_delta求出，见PythonHighlighter.block_state。
+STATE_NORMAL = 0
+STATE_TRIPLESINGLE = 1
+STATE_TRIPLEDOUBLE = 2
+STATE_ERROR = 3
+
+MODE_MASK = 0x3
+DEPTH_MAX = 63  # 括号层数的上限，超过时按DEPTH_MAX计
+PREFIX_SHIFT = 2
+PREFIX_RAW = 1
+PREFIX_BYTES = 2
+PREFIX_FORMAT = 4
+CONTINUATION = 1 << 5
+
+BlockState = namedtuple('BlockState', ['mode', 'depth', 'prefix', 'continued'])
+
+KEYWORDS = ["and", "as", "assert", 'async', 'await', "break", "class",
+            "continue", "def", "del", "elif", "else", "except",
+            "exec", "finally", "for", "from", "global", "if",
+            "import", "in", "is", "lambda", "not", "or", "pass",
+            "raise", "return", "try", "while", "with", "yield"]
+BUILTINS = ["abs", "all", "any", "basestring", "bool",
+            "callable", "chr", "classmethod", "cmp", "compile",
+            "complex", "delattr", "dict", "dir", "divmod",
+            "enumerate", "eval", "execfile", "exit", "file",
+            "filter", "float", "frozenset", "getattr", "globals",
+            "hasattr", "hex", "name", "int", "isinstance",
+            "issubclass", "iter", "len", "list", "locals", "map",
+            "max", "min", "object", "oct", "open", "ord", "pow",
+            "property", "range", "reduce", "repr", "reversed",
+            "round", "set", "setattr", "slice", "sorted",
+            "staticmethod", "str", "sum", "super", "tuple", "type",
+            "vars", "zip"]
+CONSTANTS = ["False", "True", "None", "NotImplemented",
+             "Ellipsis"]
+
+
+def _words_re(words: List[str]) -> str:
+    # 较长的词放在前面，避免alternation在较短的前缀上提前结束。
+    return r"\b(?:%s)\b" % "|".join(sorted(words, key=len, reverse=True))
+
+
+# 各分支的顺序即为优先级。三引号必须排在普通字符串之前，否则'''会被识别为空字符串加一个引号。
+# 关键字等也写进正则表达式中，这样跳过普通标识符的工作全部在C代码中完成。
+PYTHON_TOKEN_PATTERN = r"""
+     (?P<comment>\#.*)
+    |(?P<triple>'''|\"\"\")
+    |(?P<string>'[^']*'|"[^"]*")
+    |(?P<keyword>%s)
+    |(?P<builtin>%s)
+    |(?P<constant>%s)
+    |(?P<number>\b[+-]?(?:0[xX][0-9A-Fa-f]+[lL]?
+                       |[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?[lL]?)\b)
+    |(?P<decorator>(?<=\w)@\w+\b)
+"""
+
+
+def _compile_python_rules() -> LexerRules:
+    pattern = re.compile(PYTHON_TOKEN_PATTERN % (_words_re(KEYWORDS), _words_re(BUILTINS), _words_re(CONSTANTS)),
+                         re.VERBOSE)
+    # 分组序号到类别id的映射，下标即为match.lastindex。
+    group_categories = [NORMAL] * (pattern.groups + 1)
+    for name, category in (('comment', COMMENT), ('string', STRING), ('keyword', KEYWORD), ('builtin', BUILTIN),
+                           ('constant', CONSTANT), ('number', NUMBER), ('decorator', DECORATOR)):
+        group_categories[pattern.groupindex[name]] = category
+    return LexerRules('python', pattern, tuple(group_categories),
+                      pattern.groupindex['comment'], pattern.groupindex['triple'])
+
+
+register_language('python', _compile_python_rules)
+
+TRIPLE_STATES = {"'''": STATE_TRIPLESINGLE, '"""': STATE_TRIPLEDOUBLE}
+TRIPLE_DELIMITERS = {STATE_TRIPLESINGLE: "'''", STATE_TRIPLEDOUBLE: '"""'}
+PREFIX_FLAGS = {'r': PREFIX_RAW, 'b': PREFIX_BYTES, 'f': PREFIX_FORMAT}
+
+Span = Tuple[int, int, int]
+
+
+def pack_state(mode: int, prefix: int = 0, continued: bool = False) -> int:
+    """
+    把各项词法上下文合并为一个块状态
+    :param mode: STATE_*
+    :param prefix: PREFIX_*的组合
+    :param continued: 行尾是否有续行的反斜杠
+    :return:
+    """
+    state = mode | prefix << PREFIX_SHIFT
+    return state | CONTINUATION if continued else state
+
+
+def unpack_state(state: int, depth: int = 0) -> BlockState:
+    """
+    拆分块状态。负数（Qt中尚未着色的块）按STATE_NORMAL处理。
+    :param state:
+    :param depth: 行尾未闭合的括号层数，不在块状态中，由调用者另外求出
+    :return:
+    """
+    if state < 0:
+        state = STATE_NORMAL
+    return BlockState(state & MODE_MASK, depth, state >> PREFIX_SHIFT & 0x7, bool(state & CONTINUATION))
+
+
+def state_mode(state: int) -> int:
+    return state & MODE_MASK if state >= 0 else STATE_NORMAL
+
+
+def _bracket_delta(text: str) -> int:
+    return text.count('(') + text.count('[') + text.count('{') - text.count(')') - text.count(']') - text.count('}')
+
+
+def has_brackets(text: str) -> bool:
+    return '(' in text or '[' in text or '{' in text or ')' in text or ']' in text or '}' in text
+
+
+def _string_prefix(text: str, start: int) -> int:
+    prefix = 0
+    pos = start - 1
+    while pos >= 0 and start - pos <= 2:
+        flag = PREFIX_FLAGS.get(text[pos].lower())
+        if flag is None:
+            break
+        prefix |= flag
+        pos -= 1
+    if pos >= 0 and (text[pos].isalnum() or text[pos] == '_'):
+        return 0  # 前面的字母属于一个标识符，比如abr'''
+    return prefix
+
+
+def bracket_delta(text: str, spans: Sequence[Span], state: int) -> int:
+    """
+    求一行代码部分（字符串和注释之外）的括号增减数。上一行行尾的括号层数加上它，再限制在0到DEPTH_MAX之间，
+    就是本行行尾的括号层数。
+    先统计整行的括号，再减去字符串和注释中的括号，这样计数全部在C代码中完成。
+    :param text:
+    :param spans: tokenize返回的区段
+    :param state: tokenize返回的本行结束时的状态
+    :return: 错误行返回-DEPTH_MAX，即之后的括号层数从0开始计
+    """
+    if state & MODE_MASK == STATE_ERROR:
+        return -DEPTH_MAX
+    delta = _bracket_delta(text)
+    if delta or '(' in text or '[' in text or '{' in text:
+        for start, length, category in spans:
+            if category == STRING or category == COMMENT:
+                delta -= _bracket_delta(text[start:start + length])
+    return delta
+
+
+def _is_error_line(text: str, prev_mode: int) -> bool:
+    if text.startswith("Traceback") or text.startswith("Error: "):
+        return True
+    # 非交互模式下sys没有ps1属性，这里退回到默认提示符。
+    return prev_mode == STATE_ERROR and not (text.startswith(getattr(sys, 'ps1', '>>> ')) or text.startswith("#"))
+
+
+def tokenize(text: str, prev_state: int = STATE_NORMAL, rules: LexerRules = None) -> Tuple[List[Span], int]:
+    """
+    对一行文本进行词法分析。
+    :param text: 一行文本，不含换行符
+    :param prev_state: 上一行结束时的状态，没有上一行时可以传入-1
+    :param rules: 词法规则，默认为Python的规则
+    :return: (区段列表，本行结束时的状态)。区段为(起始列，长度，类别)，按起始列排序且互不重叠；
+             未被任何区段覆盖的部分属于NORMAL类别。状态的编码见pack_state。
+    """
+    length = len(text)
+    if prev_state < 0:
+        prev_state = STATE_NORMAL
+    prev_mode = prev_state & MODE_MASK
+    if _is_error_line(text, prev_mode):
+        return [(0, length, ERROR)], STATE_ERROR
+
+    spans = []
+    pos = 0
+    if prev_mode in TRIPLE_DELIMITERS:
+        end = text.find(TRIPLE_DELIMITERS[prev_mode])
+        if end == -1:
+            return ([(0, length, STRING)] if length else []), prev_state
+        pos = end + 3
+        spans.append((0, pos, STRING))
+
+    if rules is None:
+        rules = get_lexer_rules('python')
+    group_categories = rules.group_categories
+    comment_group = rules.comment_group
+    triple_group = rules.triple_group
+    append = spans.append
+    search = rules.pattern.search
+    while True:
+        match = search(text, pos)
+        if match is None:
+            break
+        group = match.lastindex
+        start, pos = match.span()
+        if group == triple_group:
+            delimiter = match.group()
+            end = text.find(delimiter, pos)
+            if end == -1:
+                append((start, length - start, STRING))
+                return spans, pack_state(TRIPLE_STATES[delimiter], _string_prefix(text, start))
+            pos = end + 3
+            append((start, pos - start, STRING))
+        else:
+            append((start, pos - start, group_categories[group]))
+            if group == comment_group:
+                break
+    continued = text.endswith('\\') and not (spans and spans[-1][0] + spans[-1][1] == length and
+                                              spans[-1][2] in (STRING, COMMENT))
+    return spans, pack_state(STATE_NORMAL, 0, continued)